@@ -5,6 +5,7 @@ from tkinter import filedialog, simpledialog
 from PIL import Image, ImageTk
 from pathlib import Path
 import csv
+import ast
 
 class ImageApp:
     def __init__(self, root, image_path):
@@ -29,6 +30,7 @@ class ImageApp:
         if self.img is None:
             raise ValueError("Image not found or path is incorrect")
 
+        self.clean_img = self.img.copy() # Unmarked copy for cropping, ROI boxes and labels are drawn on self.img
         self.display_img = self.img.copy()
 
         # Convert image to PIL format
@@ -46,6 +48,7 @@ class ImageApp:
         self.canvas.bind("<Motion>", self.show_crop_box)
         self.canvas.bind("<MouseWheel>", self.change_box_size)
         self.initialize_csv()
+        self.load_rois()
 
     def change_box_size(self, event):
         if event.delta > 0:
@@ -93,7 +96,7 @@ class ImageApp:
         cv2.putText(self.img, label, (self.top_left[0], self.top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
 
         roi = None
-        roi = self.img[self.top_left[1]:self.bottom_right[1], self.top_left[0]:self.bottom_right[0]]
+        roi = self.clean_img[self.top_left[1]:self.bottom_right[1], self.top_left[0]:self.bottom_right[0]]
 
         print("Saving roi", self.no_roi)
 
@@ -115,6 +118,24 @@ class ImageApp:
             if file.tell() == 0:  # Check if file is empty
                 writer.writerow(['filename', 'no_roi', 'center', 'topleft', 'bottomright', 'Description'])
 
+    def load_rois(self):
+        # Draw ROIs already in the CSV file, e.g. candidates from roi_detect.py, and continue numbering after them
+        with open(self.csv_filename, mode='r', newline='') as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                try:
+                    top_left = tuple(int(value) for value in ast.literal_eval(row['topleft']))
+                    bottom_right = tuple(int(value) for value in ast.literal_eval(row['bottomright']))
+                    no_roi = int(row['no_roi'])
+                except (KeyError, TypeError, ValueError, SyntaxError):
+                    continue
+                cv2.rectangle(self.img, top_left, bottom_right, (0, 0, 255), 2)
+                cv2.putText(self.img, f"{no_roi}", (top_left[0], top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+                self.no_roi = max(self.no_roi, no_roi + 1)
+
+        self.display_img = self.img.copy()
+        self.update_image()
+
     def update_image(self):
         # Convert the updated OpenCV image to PIL format
         self.photo = ImageTk.PhotoImage(image=Image.fromarray(cv2.cvtColor(self.display_img, cv2.COLOR_BGR2RGB)))
@@ -0,0 +1,212 @@
+"""
+Vectorized geodesic helpers.
+All functions accept scalars or numpy arrays of any (broadcastable) shape and return numpy arrays (or numpy scalars).
+The spherical path uses the same earth radius as the haversine package, the ellipsoidal path uses Vincenty's formulae on WGS84.
+
+Run this file to benchmark against the per-call haversine.inverse_haversine loop:
+geodesy.py -n 1000000
+"""
+
+import argparse
+import time
+import numpy as np
+
+EARTH_RADIUS = 6371008.8 # meters, mean earth radius as in haversine package
+METERS_PER_DEGREE = 111320 # Approximate meters per degree latitude
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+VINCENTY_MAX_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+
+def haversine(lat1, lon1, lat2, lon2, ellipsoidal=False):
+    """
+    Distance between points (decimal degrees), in meters.
+
+    Parameters:
+      lat1, lon1, lat2, lon2 (float or ndarray): Start and end points.
+      ellipsoidal (bool): Use Vincenty on WGS84 instead of a sphere.
+
+    Returns:
+      ndarray: Distance in meters.
+    """
+    if ellipsoidal:
+        return vincenty_inverse(lat1, lon1, lat2, lon2)
+
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+def inverse_haversine(lat, lon, distance, bearing_radians, ellipsoidal=False):
+    """
+    Point at a distance and bearing from a start point, vectorized haversine.inverse_haversine.
+
+    Parameters:
+      lat, lon (float or ndarray): Start point in decimal degrees.
+      distance (float or ndarray): Distance in meters.
+      bearing_radians (float or ndarray): Bearing clockwise from north.
+      ellipsoidal (bool): Use Vincenty on WGS84 instead of a sphere.
+
+    Returns:
+      tuple: (lat, lon) in decimal degrees.
+    """
+    if ellipsoidal:
+        return vincenty_direct(lat, lon, distance, bearing_radians)
+
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    angular_distance = np.asarray(distance, dtype=np.float64) / EARTH_RADIUS
+
+    lat2 = np.arcsin(np.sin(lat) * np.cos(angular_distance) + np.cos(lat) * np.sin(angular_distance) * np.cos(bearing_radians))
+    lon2 = lon + np.arctan2(np.sin(bearing_radians) * np.sin(angular_distance) * np.cos(lat),
+                            np.cos(angular_distance) - np.sin(lat) * np.sin(lat2))
+    return np.degrees(lat2), np.degrees(lon2)
+
+def acoustic_bearing_radians(heading, is_starboard):
+    # Offset sensor heading (degrees) by 90 degrees to starboard or port, returns bearing in radians
+    offset = 90 if is_starboard else -90
+    return np.radians(np.asarray(heading, dtype=np.float64) + offset)
+
+def degrees_to_meters(degree_value, latitude, for_longitude=True):
+    # Approximate linear size of a degree value, longitude degrees shrink with cos(latitude)
+    meters_per_degree = METERS_PER_DEGREE * np.cos(np.radians(latitude)) if for_longitude else METERS_PER_DEGREE
+    return np.asarray(degree_value, dtype=np.float64) * meters_per_degree
+
+def meters_to_degrees(meters, latitude, for_longitude=True):
+    # Inverse of degrees_to_meters
+    meters_per_degree = METERS_PER_DEGREE * np.cos(np.radians(latitude)) if for_longitude else METERS_PER_DEGREE
+    return np.asarray(meters, dtype=np.float64) / meters_per_degree
+
+def vincenty_direct(lat, lon, distance, bearing_radians):
+    """
+    Vincenty's direct formula on WGS84, vectorized. Converges for all inputs.
+
+    Returns:
+      tuple: (lat, lon) in decimal degrees.
+    """
+    lat, lon, distance, alpha1 = np.broadcast_arrays(np.radians(lat), np.radians(lon), np.asarray(distance, dtype=np.float64), np.asarray(bearing_radians, dtype=np.float64))
+
+    sin_alpha1 = np.sin(alpha1)
+    cos_alpha1 = np.cos(alpha1)
+
+    tan_u1 = (1 - WGS84_F) * np.tan(lat)
+    cos_u1 = 1 / np.sqrt(1 + tan_u1**2)
+    sin_u1 = tan_u1 * cos_u1
+
+    sigma1 = np.arctan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1 * sin_alpha1
+    cos_sq_alpha = 1 - sin_alpha**2
+    u_sq = cos_sq_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+
+    sigma = distance / (WGS84_B * A)
+    for _ in range(VINCENTY_MAX_ITERATIONS):
+        cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+        sin_sigma = np.sin(sigma)
+        cos_sigma = np.cos(sigma)
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m**2) -
+                      B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)))
+        sigma_previous = sigma
+        sigma = distance / (WGS84_B * A) + delta_sigma
+        if np.all(np.abs(sigma - sigma_previous) < VINCENTY_TOLERANCE):
+            break
+
+    cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+    sin_sigma = np.sin(sigma)
+    cos_sigma = np.cos(sigma)
+
+    x = sin_u1 * sin_sigma - cos_u1 * cos_sigma * cos_alpha1
+    lat2 = np.arctan2(sin_u1 * cos_sigma + cos_u1 * sin_sigma * cos_alpha1, (1 - WGS84_F) * np.sqrt(sin_alpha**2 + x**2))
+    lam = np.arctan2(sin_sigma * sin_alpha1, cos_u1 * cos_sigma - sin_u1 * sin_sigma * cos_alpha1)
+    C = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+    L = lam - (1 - C) * WGS84_F * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2)))
+
+    return np.degrees(lat2), np.degrees(lon + L)
+
+def vincenty_inverse(lat1, lon1, lat2, lon2):
+    """
+    Vincenty's inverse formula on WGS84, vectorized.
+    Nearly antipodal points where the iteration does not converge fall back to the spherical distance.
+
+    Returns:
+      ndarray: Distance in meters.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*map(np.radians, [lat1, lon1, lat2, lon2]))
+
+    L = lon2 - lon1
+    u1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lam = np.sin(lam)
+            cos_lam = np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam)**2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)**2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lam / sin_sigma) # Coincident points
+            cos_sq_alpha = 1 - sin_alpha**2
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha) # Equatorial line
+            C = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+            lam_previous = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2)))
+            converged = np.abs(lam - lam_previous) < VINCENTY_TOLERANCE
+            if np.all(converged):
+                break
+
+    u_sq = cos_sq_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m**2) -
+                  B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)))
+    distance = WGS84_B * A * (sigma - delta_sigma)
+
+    return np.where(converged, distance, haversine(np.degrees(lat1), np.degrees(lon1), np.degrees(lat2), np.degrees(lon2)))
+
+def benchmark(n_points):
+    # Compare today's per-call loop with the vectorized spherical and ellipsoidal paths
+    from haversine import inverse_haversine as scalar_inverse_haversine, Unit
+
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(-80, 80, n_points)
+    lon = rng.uniform(-180, 180, n_points)
+    distance = rng.uniform(0, 200, n_points)
+    bearing = rng.uniform(0, 2 * np.pi, n_points)
+
+    start = time.perf_counter()
+    looped = np.array([scalar_inverse_haversine((la, lo), d, b, Unit.METERS) for la, lo, d, b in zip(lat.tolist(), lon.tolist(), distance.tolist(), bearing.tolist())])
+    time_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector_lat, vector_lon = inverse_haversine(lat, lon, distance, bearing)
+    time_vector = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ellipsoid_lat, ellipsoid_lon = inverse_haversine(lat, lon, distance, bearing, ellipsoidal=True)
+    time_ellipsoid = time.perf_counter() - start
+
+    max_difference = max(np.abs(looped[:, 0] - vector_lat).max(), np.abs(looped[:, 1] - vector_lon).max())
+    ellipsoid_difference = haversine(vector_lat, vector_lon, ellipsoid_lat, ellipsoid_lon).max()
+
+    print(f"Points: {n_points}")
+    print(f"Per-call haversine.inverse_haversine loop: {time_loop:.3f} s")
+    print(f"Vectorized spherical: {time_vector:.3f} s, {time_loop / time_vector:.0f}x faster, max difference {max_difference:.2e} degrees")
+    print(f"Vectorized ellipsoidal (Vincenty WGS84): {time_ellipsoid:.3f} s, max offset from spherical {ellipsoid_difference:.3f} m")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark vectorized geodesic helpers against the per-call loop.')
+    parser.add_argument('-n', '--points', default=1000000, type=int, help='Number of points. (default 1000000)')
+    args = parser.parse_args()
+
+    benchmark(args.points)
@@ -0,0 +1,334 @@
+"""
+Renders georeferenced sonar GeoTIFFs (e.g. *_geotiff.tif from xtf_to_geotiff_and_geojpeg.py, or a mosaic) into a
+Web Mercator tile pyramid stored in an MBTiles file, for viewing in a browser map over a slow link.
+
+Only tiles that intersect a source footprint are rendered, in parallel. The deepest zoom level is sampled directly from the
+sources, lower zoom levels are downsampled from their four children. Sources are recorded in the MBTiles file, so
+re-running after adding or changing one line only re-renders the tiles it touches.
+"""
+
+import io
+import json
+import math
+import sqlite3
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import rasterio
+
+import geodesy # Local vectorized geodesic helpers
+
+TILE_SIZE = 256
+MAX_ZOOM_LIMIT = 24
+WEB_MERCATOR_RESOLUTION = 156543.03392804097 # meters per pixel at zoom 0 on the equator
+SOURCE_CACHE_SIZE = 4 # Sources kept in memory per worker process
+
+_source_cache = {}
+
+def lonlat_to_tile(lon, lat, zoom):
+    # Fractional XYZ tile coordinates, y counted from the north
+    n = 2 ** zoom
+    lat_radians = np.radians(lat)
+    x = (np.asarray(lon) + 180) / 360 * n
+    y = (1 - np.log(np.tan(lat_radians) + 1 / np.cos(lat_radians)) / np.pi) / 2 * n
+    return x, y
+
+def tile_pixel_lonlat(zoom, x, y):
+    # Longitude and latitude of every pixel center in a tile, as TILE_SIZE x TILE_SIZE arrays
+    n = 2 ** zoom
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lon = (x + offsets) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return np.meshgrid(lon, lat)
+
+def tiles_touching(footprint, zoom):
+    """
+    Finds all tiles at a zoom level that intersect a convex footprint, separating axis test vectorized over candidate tiles.
+
+    Parameters:
+      footprint (list): Corner points [(lon, lat), ...] of the georeferenced image, in order around the image.
+      zoom (int): Zoom level.
+
+    Returns:
+      set: (x, y) tile indices.
+    """
+    corners = np.asarray(footprint, dtype=np.float64)
+    fx, fy = lonlat_to_tile(corners[:, 0], corners[:, 1], zoom)
+    quad = np.column_stack((fx, fy))
+
+    n = 2 ** zoom
+    tx, ty = np.meshgrid(np.arange(max(int(np.floor(fx.min())), 0), min(int(np.floor(fx.max())), n - 1) + 1),
+                         np.arange(max(int(np.floor(fy.min())), 0), min(int(np.floor(fy.max())), n - 1) + 1))
+    overlap = np.ones(tx.shape, dtype=bool)
+
+    # The tile axes are covered by the candidate range, test the footprint edge normals
+    for i in range(len(quad)):
+        edge = quad[(i + 1) % len(quad)] - quad[i]
+        normal = np.array([-edge[1], edge[0]])
+        projected = quad @ normal
+        tile_offsets = np.array([0, normal[0], normal[1], normal[0] + normal[1]])
+        tile_projected = tx * normal[0] + ty * normal[1]
+        overlap &= (tile_projected + tile_offsets.max() >= projected.min()) & (tile_projected + tile_offsets.min() <= projected.max())
+
+    return set(zip(tx[overlap].tolist(), ty[overlap].tolist()))
+
+def read_source_info(source_path):
+    # Footprint and pixel size of a georeferenced image, None if it is not georeferenced in EPSG:4326
+    with rasterio.open(source_path) as src:
+        if src.crs is None or src.crs.to_epsg() != 4326:
+            return None
+        transform = src.transform
+        width, height = src.width, src.height
+
+    cols = np.array([0, width, width, 0])
+    rows = np.array([0, 0, height, height])
+    lon = transform.a * cols + transform.b * rows + transform.c
+    lat = transform.d * cols + transform.e * rows + transform.f
+
+    # Shortest pixel step, along columns or rows, in meters
+    center_lat = lat.mean()
+    col_step = np.hypot(geodesy.degrees_to_meters(transform.a, center_lat), geodesy.degrees_to_meters(transform.d, center_lat, for_longitude=False))
+    row_step = np.hypot(geodesy.degrees_to_meters(transform.b, center_lat), geodesy.degrees_to_meters(transform.e, center_lat, for_longitude=False))
+
+    return {"footprint": np.column_stack((lon, lat)).tolist(), "pixel_size_m": float(min(col_step, row_step)), "center_lat": float(center_lat)}
+
+def zoom_for_pixel_size(pixel_size_m, latitude):
+    # Smallest zoom level where a tile pixel is not larger than a source pixel
+    resolution_zoom_0 = WEB_MERCATOR_RESOLUTION * math.cos(math.radians(latitude))
+    return int(min(max(math.ceil(math.log2(resolution_zoom_0 / pixel_size_m)), 0), MAX_ZOOM_LIMIT))
+
+def load_source(source_path):
+    # Source pixels as uint8 and the inverse transform, cached per worker process
+    if source_path in _source_cache:
+        return _source_cache[source_path]
+
+    with rasterio.open(source_path) as src:
+        data = src.read(1)
+        t = src.transform
+
+    # Inverse of the affine transform as (a, b, c, d, e, f), maps lon, lat to col, row
+    det = t.a * t.e - t.b * t.d
+    inverse_transform = (t.e / det, -t.b / det, (t.b * t.f - t.e * t.c) / det,
+                         -t.d / det, t.a / det, (t.d * t.c - t.a * t.f) / det)
+
+    if data.dtype == np.uint16:
+        data = (data >> 8).astype(np.uint8)
+    elif data.dtype != np.uint8:
+        vmin, vmax = float(data.min()), float(data.max())
+        data = (np.clip((data - vmin) / max(vmax - vmin, 1e-12), 0, 1) * 255).astype(np.uint8)
+
+    if len(_source_cache) >= SOURCE_CACHE_SIZE:
+        _source_cache.pop(next(iter(_source_cache)))
+    _source_cache[source_path] = (data, inverse_transform)
+    return data, inverse_transform
+
+def encode_tile(grey, alpha):
+    buffer = io.BytesIO()
+    Image.fromarray(np.dstack((grey, alpha)), 'LA').save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+def decode_tile(tile_data):
+    la = np.asarray(Image.open(io.BytesIO(tile_data)).convert('LA'))
+    return la[:, :, 0], la[:, :, 1]
+
+def render_tile(task):
+    """
+    Samples the sources (nearest neighbour) at every pixel center of a tile. Later sources are drawn on top.
+
+    Parameters:
+      task (tuple): (zoom, x, y, [source paths]).
+
+    Returns:
+      tuple: (zoom, x, y, PNG bytes) or (zoom, x, y, None) if no source pixel falls in the tile.
+    """
+    zoom, x, y, source_paths = task
+    lon, lat = tile_pixel_lonlat(zoom, x, y)
+
+    grey = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    alpha = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+
+    for source_path in source_paths:
+        data, (a, b, c, d, e, f) = load_source(source_path)
+        cols = np.floor(a * lon + b * lat + c).astype(np.int64)
+        rows = np.floor(d * lon + e * lat + f).astype(np.int64)
+        valid = (cols >= 0) & (cols < data.shape[1]) & (rows >= 0) & (rows < data.shape[0])
+        grey[valid] = data[rows[valid], cols[valid]]
+        alpha[valid] = 255
+
+    if not alpha.any():
+        return zoom, x, y, None
+    return zoom, x, y, encode_tile(grey, alpha)
+
+def downsample_tile(task):
+    """
+    Builds a tile from its four children by alpha weighted 2x2 averaging.
+
+    Parameters:
+      task (tuple): (zoom, x, y, [child PNG bytes or None for top left, top right, bottom left, bottom right]).
+    """
+    zoom, x, y, children = task
+    grey = np.zeros((2 * TILE_SIZE, 2 * TILE_SIZE), dtype=np.float32)
+    alpha = np.zeros((2 * TILE_SIZE, 2 * TILE_SIZE), dtype=np.float32)
+
+    for i, tile_data in enumerate(children):
+        if tile_data is None:
+            continue
+        row, col = divmod(i, 2)
+        child_grey, child_alpha = decode_tile(tile_data)
+        grey[row * TILE_SIZE:(row + 1) * TILE_SIZE, col * TILE_SIZE:(col + 1) * TILE_SIZE] = child_grey
+        alpha[row * TILE_SIZE:(row + 1) * TILE_SIZE, col * TILE_SIZE:(col + 1) * TILE_SIZE] = child_alpha
+
+    weighted = (grey * alpha).reshape(TILE_SIZE, 2, TILE_SIZE, 2).sum(axis=(1, 3))
+    alpha_sum = alpha.reshape(TILE_SIZE, 2, TILE_SIZE, 2).sum(axis=(1, 3))
+
+    if not alpha_sum.any():
+        return zoom, x, y, None
+
+    out_grey = np.divide(weighted, alpha_sum, out=np.zeros_like(weighted), where=alpha_sum > 0)
+    out_alpha = alpha_sum / 4
+    return zoom, x, y, encode_tile(np.round(out_grey).astype(np.uint8), np.round(out_alpha).astype(np.uint8))
+
+def open_mbtiles(mbtiles_path):
+    connection = sqlite3.connect(mbtiles_path)
+    connection.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    # Not part of the MBTiles spec, used to find what changed since the last run
+    connection.execute("CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, size INTEGER, mtime REAL, info TEXT)")
+    return connection
+
+def write_tile(connection, zoom, x, y, tile_data):
+    tile_row = 2 ** zoom - 1 - y # MBTiles rows are TMS, counted from the south
+    if tile_data is None:
+        connection.execute("DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", (zoom, x, tile_row))
+    else:
+        connection.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (zoom, x, tile_row, tile_data))
+
+def read_tile(connection, zoom, x, y):
+    row = connection.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", (zoom, x, 2 ** zoom - 1 - y)).fetchone()
+    return None if row is None else row[0]
+
+def export_mbtiles(input_folder, mbtiles_path, min_zoom=None, max_zoom=None, jobs=None):
+    connection = open_mbtiles(mbtiles_path)
+    metadata = dict(connection.execute("SELECT name, value FROM metadata").fetchall())
+    previous_sources = {name: (size, mtime, json.loads(info)) for name, size, mtime, info in connection.execute("SELECT name, size, mtime, info FROM sources")}
+
+    # Find new, changed and removed sources
+    sources = {}
+    changed = []
+    for source_path in sorted(input_folder.iterdir()):
+        if not source_path.is_file() or source_path.suffix.lower() not in ('.tif', '.tiff'):
+            continue
+        stat = source_path.stat()
+        previous = previous_sources.get(source_path.name)
+        if previous is not None and previous[0] == stat.st_size and previous[1] == stat.st_mtime:
+            sources[source_path.name] = previous[2]
+            continue
+        info = read_source_info(source_path)
+        if info is None:
+            continue
+        sources[source_path.name] = info
+        changed.append((source_path.name, stat.st_size, stat.st_mtime, info))
+
+    removed = [name for name in previous_sources if name not in sources]
+    print(f"{len(sources)} georeferenced sources, {len(changed)} new or changed, {len(removed)} removed")
+
+    if not sources:
+        # Everything that was rendered came from removed sources
+        connection.execute("DELETE FROM tiles")
+        connection.execute("DELETE FROM sources")
+        connection.execute("DELETE FROM metadata WHERE name IN ('bounds', 'center', 'minzoom', 'maxzoom')")
+        connection.commit()
+        connection.close()
+        return
+
+    # The zoom range is kept from the first run, so incremental updates stay consistent
+    stored_zoom = (int(metadata['minzoom']), int(metadata['maxzoom'])) if 'minzoom' in metadata and 'maxzoom' in metadata else None
+    if max_zoom is None:
+        max_zoom = stored_zoom[1] if stored_zoom else max(zoom_for_pixel_size(info["pixel_size_m"], info["center_lat"]) for info in sources.values())
+    if min_zoom is None:
+        min_zoom = stored_zoom[0] if stored_zoom else max(max_zoom - 8, 0)
+    if min_zoom > max_zoom:
+        raise ValueError(f"Minimum zoom {min_zoom} is larger than maximum zoom {max_zoom}")
+
+    source_tiles = {name: tiles_touching(info["footprint"], max_zoom) for name, info in sources.items()}
+
+    if stored_zoom is not None and stored_zoom != (min_zoom, max_zoom):
+        # Tiles of the old zoom range would leave holes in the pyramid, render everything again
+        print(f"Zoom range changed from {stored_zoom[0]}-{stored_zoom[1]} to {min_zoom}-{max_zoom}, rebuilding all tiles")
+        connection.execute("DELETE FROM tiles")
+        dirty = set().union(*source_tiles.values())
+    else:
+        # Tiles touched by the old or new footprint of anything that changed
+        dirty = set()
+        for name in removed:
+            dirty |= tiles_touching(previous_sources[name][2]["footprint"], max_zoom)
+        for name, _, _, info in changed:
+            dirty |= tiles_touching(info["footprint"], max_zoom)
+            if name in previous_sources:
+                dirty |= tiles_touching(previous_sources[name][2]["footprint"], max_zoom)
+
+    tasks = [(max_zoom, x, y, [str(input_folder / name) for name in sources if (x, y) in source_tiles[name]]) for x, y in dirty]
+    tasks.sort(key=lambda task: (task[3], task[2], task[1])) # Keep tiles of the same source together in each worker
+
+    print(f"Rendering {len(tasks)} tiles at zoom {max_zoom}")
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for zoom, x, y, tile_data in executor.map(render_tile, tasks, chunksize=64):
+            write_tile(connection, zoom, x, y, tile_data)
+        connection.commit()
+
+        for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+            dirty = {(x // 2, y // 2) for x, y in dirty}
+            tasks = [(zoom, x, y, [read_tile(connection, zoom + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1)]) for x, y in dirty]
+            print(f"Rendering {len(tasks)} tiles at zoom {zoom}")
+            for zoom_level, x, y, tile_data in executor.map(downsample_tile, tasks, chunksize=16):
+                write_tile(connection, zoom_level, x, y, tile_data)
+            connection.commit()
+
+    for name in removed:
+        connection.execute("DELETE FROM sources WHERE name=?", (name,))
+    for name, size, mtime, info in changed:
+        connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)", (name, size, mtime, json.dumps(info)))
+
+    corners = np.array([corner for info in sources.values() for corner in info["footprint"]])
+    bounds = [corners[:, 0].min(), corners[:, 1].min(), corners[:, 0].max(), corners[:, 1].max()]
+    metadata.update({
+        "name": mbtiles_path.stem,
+        "format": "png",
+        "type": "overlay",
+        "version": "1",
+        "description": "Georeferenced sonar imagery",
+        "bounds": ",".join(f"{value:.8f}" for value in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.8f},{(bounds[1] + bounds[3]) / 2:.8f},{min_zoom}",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+    })
+    connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", metadata.items())
+    connection.commit()
+    connection.close()
+    print(f"Saved {mbtiles_path}, zoom {min_zoom}-{max_zoom}")
+
+def main(args):
+    input_folder = Path(args.input)
+    mbtiles_path = Path(args.output)
+
+    if not input_folder.is_dir():
+        print(f"The provided path {input_folder} is not a directory.")
+        return
+
+    mbtiles_path.parent.mkdir(parents=True, exist_ok=True)
+    export_mbtiles(input_folder, mbtiles_path, min_zoom=args.min_zoom, max_zoom=args.max_zoom, jobs=args.jobs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render all georeferenced .tif in a folder into a Web Mercator MBTiles pyramid.')
+    parser.add_argument('-i', '--input', default="output", type=str, help='Input folder with georeferenced tif (EPSG:4326).')
+    parser.add_argument('-o', '--output', default="output/sonar.mbtiles", type=str, help='Output MBTiles file, updated incrementally if it exists.')
+    parser.add_argument('-minz', '--min_zoom', default=None, type=int, help='Lowest zoom level. (default 8 below max zoom)')
+    parser.add_argument('-maxz', '--max_zoom', default=None, type=int, help='Highest zoom level. (default from source resolution)')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help='Worker processes. (default CPU count)')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,84 @@
+"""
+Slant range to ground range correction of a ping x sample matrix.
+Samples are recorded equally spaced in slant range, this resamples every ping onto an equally spaced ground range axis
+with ground = sqrt(slant^2 - altitude^2), see xtf_coordinates.calculate_ground_range.
+
+Interpolation indices only depend on altitude, slant range and number of samples, so they are computed once per
+altitude bucket and applied to the whole block of pings in that bucket with a numpy gather.
+"""
+
+import numpy as np
+
+DEFAULT_ALTITUDE_STEP = 0.1 # meters, pings with altitudes within one step share interpolation indices
+
+def ping_geometry_from_pings(pings, channel=0):
+    # SlantRange, GroundRange and SensorPrimaryAltitude of pyxtf ping objects, as arrays
+    slant_range = np.array([ping.ping_chan_headers[channel].SlantRange for ping in pings], dtype=np.float64)
+    ground_range = np.array([ping.ping_chan_headers[channel].GroundRange for ping in pings], dtype=np.float64)
+    altitude = np.array([ping.SensorPrimaryAltitude for ping in pings], dtype=np.float64)
+    return slant_range, ground_range, altitude
+
+def ping_geometry_from_headers(ping_headers, ping_chan_headers):
+    # Same as ping_geometry_from_pings, from the structured header arrays of xtf_headers or a ping store
+    return (ping_chan_headers['SlantRange'].astype(np.float64), ping_chan_headers['GroundRange'].astype(np.float64),
+            ping_headers['SensorPrimaryAltitude'].astype(np.float64))
+
+def interpolation_indices(n_samples, slant_range, altitude, ground_spacing, n_out):
+    """
+    Sample positions in slant range for each output ground range bin of one ping geometry.
+
+    Returns:
+      tuple: (index, weight, valid) arrays of length n_out, value = data[index] * (1 - weight) + data[index + 1] * weight.
+    """
+    ground = (np.arange(n_out) + 0.5) * ground_spacing
+    slant = np.sqrt(ground**2 + altitude**2)
+    position = slant / slant_range * n_samples - 0.5 # Fractional sample index, sample centers at (i + 0.5) * spacing
+
+    valid = (position >= 0) & (position <= n_samples - 1)
+    position = np.clip(position, 0, n_samples - 1)
+    index = np.minimum(np.floor(position).astype(np.int64), n_samples - 2)
+    weight = (position - index).astype(np.float32)
+    return index, weight, valid
+
+def slant_to_ground_range(np_chan, slant_range, ground_range, altitude, is_starboard=True, altitude_step=DEFAULT_ALTITUDE_STEP):
+    """
+    Resamples pings from slant range to ground range.
+
+    Parameters:
+      np_chan (ndarray): Ping x sample matrix, sample 0 at nadir for starboard and at far range for port.
+      slant_range, ground_range, altitude (ndarray): SlantRange, GroundRange and SensorPrimaryAltitude per ping.
+      is_starboard (bool): Channel side, decides which end of the ping is nadir.
+      altitude_step (float): Altitude bucket size in meters.
+
+    Returns:
+      ndarray: float32 matrix with the same shape, columns equally spaced in ground range. Bins outside a ping's range are 0.
+    """
+    n_pings, n_samples = np_chan.shape
+    slant_range = np.asarray(slant_range, dtype=np.float64)
+    altitude = np.nan_to_num(np.clip(np.asarray(altitude, dtype=np.float64), 0, None))
+
+    # Common ground axis, as far as the longest GroundRange (or computed ground range if not recorded)
+    computed_ground_range = np.sqrt(np.clip(slant_range**2 - altitude**2, 0, None))
+    ground_range = np.where(np.asarray(ground_range) > 0, ground_range, computed_ground_range)
+    ground_spacing = ground_range.max() / n_samples
+
+    data = np_chan if is_starboard else np_chan[:, ::-1]
+    out = np.zeros((n_pings, n_samples), dtype=np.float32)
+
+    # Group pings sharing the same geometry, indices are computed once per group
+    altitude_bucket = np.round(altitude / altitude_step).astype(np.int64)
+    keys = np.column_stack((altitude_bucket, np.round(slant_range, 3)))
+    unique_keys, group = np.unique(keys, axis=0, return_inverse=True)
+    group = group.ravel()
+
+    for g, (bucket, bucket_slant_range) in enumerate(unique_keys):
+        rows = np.flatnonzero(group == g)
+        if bucket_slant_range <= 0:
+            continue
+        index, weight, valid = interpolation_indices(n_samples, bucket_slant_range, bucket * altitude_step, ground_spacing, n_samples)
+        block = data[rows]
+        resampled = block[:, index] * (1 - weight) + block[:, index + 1] * weight
+        resampled[:, ~valid] = 0
+        out[rows] = resampled
+
+    return out if is_starboard else out[:, ::-1]
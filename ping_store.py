@@ -0,0 +1,239 @@
+"""
+Chunked, compressed on-disk store for the processed ping x sample matrix of one XTF file.
+Written once per XTF, so the products (8/16 bit, HEQ, colorized, geotiff, crops) do not re-read the XTF and redo
+concatenate_channel and log scaling.
+
+A store is a folder:
+  meta.json              shape, chunk shape, dtype, per-chunk statistics, raw column means, source file info
+  ping_headers.npy       ping headers, one per row (xtf_headers.ping_header_dtype)
+  ping_chan_headers.npy  first channel header, one per row (xtf_headers.ping_chan_header_dtype)
+  level_0/<i>_<j>.z      zlib compressed chunks of log10(clip(value) + 1)
+  level_<k>/<i>_<j>.z    pyramid, each level is 2x2 mean downsampled from the previous one
+
+PingStore.read() only decompresses the chunks overlapping the requested window, and value_range() gives the min and max
+of a window from the chunk statistics without decompressing anything.
+
+xtf2tiff.py (-s) reads the columns kept by the column threshold, or whole pings with -gr, at full resolution or at a
+coarser level (-sl) for previews, scaled with the full resolution value range. xtf_to_geotiff_and_geojpeg.py
+(use_ping_store) reads a whole level. The image tools (click_crop*.py, concat_tiff.py, colorize_image.py,
+geotiff_to_mbtiles.py) work on the tiffs those two write and do not open stores.
+"""
+
+import json
+import zlib
+import numpy as np
+from pathlib import Path
+
+import xtf_headers # Local metadata-only XTF reader
+
+STORE_VERSION = 1
+UPPER_LIMIT = 2 ** 16
+LOG_MAX = np.log10(UPPER_LIMIT) # Largest log value, log10(65535 + 1)
+DEFAULT_CHUNK_SHAPE = (1024, 1024)
+
+def chunk_statistics(chunk):
+    return {"min": float(chunk.min()), "max": float(chunk.max()), "mean": float(chunk.mean()), "std": float(chunk.std())}
+
+def downsample_2x2(data):
+    # Mean of 2x2 blocks, an odd last row or column is dropped
+    rows, cols = data.shape[0] // 2 * 2, data.shape[1] // 2 * 2
+    return data[:rows, :cols].reshape(rows // 2, 2, cols // 2, 2).mean(axis=(1, 3), dtype=np.float32)
+
+def write_level(store_path, level, data, chunk_shape, dtype):
+    # Writes one pyramid level as compressed chunks, returns per-chunk statistics keyed "<i>_<j>"
+    level_path = store_path / f"level_{level}"
+    level_path.mkdir(parents=True, exist_ok=True)
+
+    statistics = {}
+    for i in range(0, data.shape[0], chunk_shape[0]):
+        for j in range(0, data.shape[1], chunk_shape[1]):
+            chunk = data[i:i + chunk_shape[0], j:j + chunk_shape[1]]
+            key = f"{i // chunk_shape[0]}_{j // chunk_shape[1]}"
+            statistics[key] = chunk_statistics(chunk)
+            if dtype == 'uint16': # Quantize log values to the full uint16 range
+                chunk = np.round(chunk * (65535 / LOG_MAX)).astype(np.uint16)
+            (level_path / f"{key}.z").write_bytes(zlib.compress(np.ascontiguousarray(chunk).tobytes(), 6))
+    return statistics
+
+def write_store(store_path, log_chan, column_mean, ping_headers, ping_chan_headers, source=None, chunk_shape=DEFAULT_CHUNK_SHAPE, dtype='uint16'):
+    """
+    Writes a log-scaled ping x sample matrix with its navigation to a store.
+
+    Parameters:
+      store_path (Path): Store folder, created if missing.
+      log_chan (ndarray): log10(clip(value, 0, 65535) + 1) as float32, one row per ping.
+      column_mean (ndarray): Mean raw value per column, used for empty column removal.
+      ping_headers, ping_chan_headers (ndarray): Structured header arrays from xtf_headers, one per row.
+      source (dict): Information about the source file, stored in meta.json.
+      chunk_shape (tuple): Rows and columns per chunk.
+      dtype (str): 'uint16' (quantized, smaller) or 'float32'.
+    """
+    if dtype not in ('uint16', 'float32'):
+        raise ValueError(f"Invalid store dtype {dtype}, only uint16 or float32 accepted")
+
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    np.save(store_path / "ping_headers.npy", ping_headers)
+    np.save(store_path / "ping_chan_headers.npy", ping_chan_headers)
+
+    levels = []
+    data = np.asarray(log_chan, dtype=np.float32)
+    level = 0
+    while True:
+        statistics = write_level(store_path, level, data, chunk_shape, dtype)
+        levels.append({"shape": list(data.shape), "chunk_statistics": statistics})
+        if (data.shape[0] <= chunk_shape[0] and data.shape[1] <= chunk_shape[1]) or min(data.shape) < 2:
+            break
+        data = downsample_2x2(data)
+        level += 1
+
+    meta = {
+        "version": STORE_VERSION,
+        "chunk_shape": list(chunk_shape),
+        "dtype": dtype,
+        "levels": levels,
+        "column_mean": np.asarray(column_mean, dtype=np.float64).tolist(),
+        "source": source or {},
+    }
+    (store_path / "meta.json").write_text(json.dumps(meta))
+
+def build_store(xtf_path, store_path, weighted=True, chunk_shape=DEFAULT_CHUNK_SHAPE, dtype='uint16'):
+    # Reads the XTF once through pyxtf and writes its store
+    from pyxtf import xtf_read, concatenate_channel, XTFHeaderType
+
+    xtf_path = Path(xtf_path)
+    (fh, p) = xtf_read(xtf_path)
+    if XTFHeaderType.sonar not in p:
+        raise ValueError(f"No sonar pings in {xtf_path}")
+
+    np_chan = concatenate_channel(p[XTFHeaderType.sonar], file_header=fh, channel=0, weighted=weighted)
+    column_mean = np.mean(np_chan, axis=0)
+    np_chan.clip(0, UPPER_LIMIT - 1, out=np_chan)
+    log_chan = np.log10(np_chan + 1, dtype=np.float32)
+
+    header, ping_headers, ping_chan_headers = xtf_headers.read_ping_headers(xtf_path)
+    if len(ping_headers) != np_chan.shape[0]: # Rows and headers are indexed together, e.g. by ground range correction
+        raise ValueError(f"{xtf_path.name}: {np_chan.shape[0]} pings from pyxtf but {len(ping_headers)} ping headers")
+    stat = xtf_path.stat()
+    source = {
+        "file": xtf_path.name,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "weighted": weighted,
+        "nav_units": int(header['NavUnits']),
+        "is_starboard": xtf_headers.is_starboard_channel(header),
+    }
+    write_store(store_path, log_chan, column_mean, ping_headers, ping_chan_headers, source=source, chunk_shape=chunk_shape, dtype=dtype)
+    return PingStore(store_path)
+
+def open_or_build_store(xtf_path, store_folder_path, weighted=True):
+    """
+    Opens the store of an XTF file in store_folder_path, building it first if it is missing or older than the XTF.
+
+    Returns:
+      PingStore: The store.
+    """
+    xtf_path = Path(xtf_path)
+    store_path = Path(store_folder_path) / f"{xtf_path.stem}.pings"
+    meta_path = store_path / "meta.json"
+
+    if meta_path.is_file():
+        meta = json.loads(meta_path.read_text())
+        source = meta.get("source", {})
+        stat = xtf_path.stat()
+        if meta.get("version") == STORE_VERSION and source.get("size") == stat.st_size and source.get("mtime") == stat.st_mtime and source.get("weighted") == weighted:
+            return PingStore(store_path)
+
+    print(f"Building ping store {store_path}")
+    return build_store(xtf_path, store_path, weighted=weighted)
+
+class PingStore:
+    def __init__(self, store_path):
+        self.store_path = Path(store_path)
+        self.meta = json.loads((self.store_path / "meta.json").read_text())
+        self.chunk_shape = tuple(self.meta["chunk_shape"])
+        self.dtype = self.meta["dtype"]
+        self.source = self.meta["source"]
+        self.column_mean = np.asarray(self.meta["column_mean"])
+        self.ping_headers = np.load(self.store_path / "ping_headers.npy")
+        self.ping_chan_headers = np.load(self.store_path / "ping_chan_headers.npy")
+
+    @property
+    def shape(self):
+        return self.level_shape(0)
+
+    @property
+    def level_count(self):
+        return len(self.meta["levels"])
+
+    def level_shape(self, level):
+        return tuple(self.meta["levels"][level]["shape"])
+
+    def chunk_statistics(self, level=0):
+        return self.meta["levels"][level]["chunk_statistics"]
+
+    def value_range(self, rows=slice(None), cols=slice(None), level=0):
+        # Min and max log value of the chunks overlapping a window, from the chunk statistics without reading data
+        level_rows, level_cols = self.level_shape(level)
+        row_start, row_stop, _ = rows.indices(level_rows)
+        col_start, col_stop, _ = cols.indices(level_cols)
+        chunk_rows, chunk_cols = self.chunk_shape
+        statistics = self.chunk_statistics(level)
+        keys = [f"{i}_{j}" for i in range(row_start // chunk_rows, (row_stop - 1) // chunk_rows + 1)
+                for j in range(col_start // chunk_cols, (col_stop - 1) // chunk_cols + 1)]
+        return min(statistics[key]["min"] for key in keys), max(statistics[key]["max"] for key in keys)
+
+    def level_column_mean(self, level=0):
+        # Raw column means on the columns of a pyramid level, pairs are averaged like downsample_2x2
+        column_mean = self.column_mean
+        for _ in range(level):
+            cols = column_mean.shape[0] // 2 * 2
+            column_mean = column_mean[:cols].reshape(-1, 2).mean(axis=1)
+        return column_mean
+
+    def level_ping_headers(self, level=0):
+        # Ping and channel headers of the first ping in each row of a pyramid level
+        rows = self.level_shape(level)[0]
+        return self.ping_headers[::2 ** level][:rows], self.ping_chan_headers[::2 ** level][:rows]
+
+    def read_chunk(self, level, i, j):
+        level_rows, level_cols = self.level_shape(level)
+        rows = min(self.chunk_shape[0], level_rows - i * self.chunk_shape[0])
+        cols = min(self.chunk_shape[1], level_cols - j * self.chunk_shape[1])
+        raw = zlib.decompress((self.store_path / f"level_{level}" / f"{i}_{j}.z").read_bytes())
+        chunk = np.frombuffer(raw, dtype=self.dtype).reshape(rows, cols)
+        if self.dtype == 'uint16':
+            return chunk.astype(np.float32) * np.float32(LOG_MAX / 65535)
+        return chunk.copy()
+
+    def read(self, rows=slice(None), cols=slice(None), level=0):
+        """
+        Reads a window of log values, only the chunks overlapping it are decompressed.
+
+        Parameters:
+          rows, cols (slice): Window in pings and samples of the given level, step must be 1.
+          level (int): Pyramid level, 0 is full resolution, each level halves both axes.
+
+        Returns:
+          ndarray: float32 log10 values.
+        """
+        level_rows, level_cols = self.level_shape(level)
+        row_start, row_stop, row_step = rows.indices(level_rows)
+        col_start, col_stop, col_step = cols.indices(level_cols)
+        if row_step != 1 or col_step != 1:
+            raise ValueError("Only slices with step 1 can be read from a PingStore")
+
+        out = np.empty((max(row_stop - row_start, 0), max(col_stop - col_start, 0)), dtype=np.float32)
+        if out.size == 0:
+            return out
+
+        chunk_rows, chunk_cols = self.chunk_shape
+        for i in range(row_start // chunk_rows, (row_stop - 1) // chunk_rows + 1):
+            for j in range(col_start // chunk_cols, (col_stop - 1) // chunk_cols + 1):
+                chunk = self.read_chunk(level, i, j)
+                r0, c0 = i * chunk_rows, j * chunk_cols
+                r_from, r_to = max(row_start, r0), min(row_stop, r0 + chunk.shape[0])
+                c_from, c_to = max(col_start, c0), min(col_stop, c0 + chunk.shape[1])
+                out[r_from - row_start:r_to - row_start, c_from - col_start:c_to - col_start] = chunk[r_from - r0:r_to - r0, c_from - c0:c_to - c0]
+        return out
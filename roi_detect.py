@@ -0,0 +1,215 @@
+"""
+Batch detection of target candidates in converted sonar lines, to pre-populate the ROIs of click_crop_tk.py.
+
+A target usually shows as a highlight followed by an acoustic shadow further out in range. Each line is smoothed
+(boxcar) and compared with its local background mean and standard deviation from integral images. Bright and dark
+outliers are grouped with connected components, and highlights are paired with the nearest shadow on the far side.
+Candidates are written to roi_<stem>.csv in the schema of click_crop_tk.ImageApp.write_to_csv, so the viewer opens
+with them loaded. Earlier automatic candidates are replaced, ROIs entered by hand are kept.
+"""
+
+import os
+import re
+import csv
+import argparse
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+import speckle_filter # Local filters, integral image local statistics
+
+AUTO_DESCRIPTION = "auto: highlight/shadow score"
+AUTO_DESCRIPTION_PATTERN = re.compile(re.escape(AUTO_DESCRIPTION) + r" -?\d+\.\d") # Whole Description of a detector row
+CSV_HEADER = ['filename', 'no_roi', 'center', 'topleft', 'bottomright', 'Description']
+IMAGE_SUFFIXES = ('.tif', '.tiff', '.png', '.jpg', '.jpeg') # In order of preference when a line exists in several formats
+SQUARE_SIZES = [50, 100, 150, 200, 250, 300, 500, 1000] # Same as click_crop_tk.ImageApp.square_sizes
+
+def read_grey_image(image_path):
+    image = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Image {image_path} not found or unreadable")
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image.astype(np.float32)
+
+def side_from_name(stem):
+    # HiSAS line names contain -S- for starboard and -P- for port, e.g. sasi-S-upper-...
+    if '-S-' in stem:
+        return 'starboard'
+    elif '-P-' in stem:
+        return 'port'
+    return None
+
+def components(mask, min_area, max_area):
+    # Connected components of a mask, as arrays of bounding boxes (x, y, w, h), areas and centroids
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    stats, centroids = stats[1:], centroids[1:] # Label 0 is background
+    keep = (stats[:, cv2.CC_STAT_AREA] >= min_area) & (stats[:, cv2.CC_STAT_AREA] <= max_area)
+    return stats[keep, :4], stats[keep, cv2.CC_STAT_AREA], centroids[keep], labels, np.flatnonzero(keep) + 1
+
+def detect_candidates(image, side=None, smooth_size=5, background_size=101, highlight_z=3.0, shadow_z=1.5,
+                      min_highlight_area=15, min_shadow_area=30, max_area=20000, max_gap=150):
+    """
+    Finds highlight/shadow pairs in a greyscale sonar line.
+
+    Parameters:
+      image (ndarray): Greyscale line, one row per ping, range along columns.
+      side (str): 'starboard' (range increases with column), 'port' (range decreases) or None for both.
+      smooth_size, background_size (int): Odd window sizes for speckle smoothing and background statistics.
+      highlight_z, shadow_z (float): Standard deviations above/below the background for highlight/shadow pixels.
+      min_highlight_area, min_shadow_area, max_area (int): Component size limits in pixels.
+      max_gap (int): Largest range distance in pixels from a highlight to its shadow.
+
+    Returns:
+      list: Candidates as dicts with bounding box (x0, y0, x1, y1), center and score, strongest first.
+    """
+    smoothed = speckle_filter.boxcar(image, smooth_size)
+    mean, variance = speckle_filter.local_statistics(smoothed, background_size)
+    z = (smoothed - mean) / np.sqrt(variance + 1e-6)
+
+    h_boxes, h_areas, h_centroids, h_labels, h_ids = components(z > highlight_z, min_highlight_area, max_area)
+    s_boxes, s_areas, s_centroids, s_labels, s_ids = components(z < -shadow_z, min_shadow_area, max_area)
+    if len(h_boxes) == 0 or len(s_boxes) == 0:
+        return []
+
+    # Pair every highlight with every shadow at once, rows must overlap and the shadow must lie further out in range
+    h_x0, h_y0, h_x1, h_y1 = h_boxes[:, 0:1], h_boxes[:, 1:2], h_boxes[:, 0:1] + h_boxes[:, 2:3], h_boxes[:, 1:2] + h_boxes[:, 3:4]
+    s_x0, s_y0, s_x1, s_y1 = s_boxes[:, 0], s_boxes[:, 1], s_boxes[:, 0] + s_boxes[:, 2], s_boxes[:, 1] + s_boxes[:, 3]
+
+    rows_overlap = (h_y0 < s_y1) & (s_y0 < h_y1)
+    gap_starboard = s_x0 - h_x1 # Shadow to the right of the highlight
+    gap_port = h_x0 - s_x1 # Shadow to the left of the highlight
+    far_side_starboard = (gap_starboard > -(h_boxes[:, 2:3] // 2)) & (gap_starboard <= max_gap)
+    far_side_port = (gap_port > -(h_boxes[:, 2:3] // 2)) & (gap_port <= max_gap)
+
+    if side == 'starboard':
+        far_side, gap = far_side_starboard, gap_starboard
+    elif side == 'port':
+        far_side, gap = far_side_port, gap_port
+    else:
+        far_side = far_side_starboard | far_side_port
+        gap = np.where(far_side_starboard, gap_starboard, gap_port)
+
+    paired = rows_overlap & far_side
+    gap = np.where(paired, np.maximum(gap, 0), np.inf)
+    best_shadow = np.argmin(gap, axis=1)
+    has_shadow = np.isfinite(gap[np.arange(len(h_boxes)), best_shadow])
+
+    # Score is the contrast between the highlight and its shadow, in background standard deviations
+    h_z = np.bincount(h_labels.ravel(), weights=z.ravel(), minlength=h_labels.max() + 1)[h_ids] / h_areas
+    s_z = np.bincount(s_labels.ravel(), weights=z.ravel(), minlength=s_labels.max() + 1)[s_ids] / s_areas
+
+    candidates = []
+    for h in np.flatnonzero(has_shadow):
+        s = best_shadow[h]
+        x0, y0 = int(min(h_x0[h, 0], s_x0[s])), int(min(h_y0[h, 0], s_y0[s]))
+        x1, y1 = int(max(h_x1[h, 0], s_x1[s])), int(max(h_y1[h, 0], s_y1[s]))
+        candidates.append({
+            "box": (x0, y0, x1, y1),
+            "center": (int(round(h_centroids[h, 0])), int(round(h_centroids[h, 1]))),
+            "score": float(h_z[h] - s_z[s]),
+        })
+
+    candidates.sort(key=lambda candidate: candidate["score"], reverse=True)
+    return candidates
+
+def square_roi(candidate, width, height):
+    # Smallest viewer square around the candidate, clipped to the image like click_crop_tk.ImageApp.draw_target
+    x0, y0, x1, y1 = candidate["box"]
+    extent = max(x1 - x0, y1 - y0)
+    square_size = next((size for size in SQUARE_SIZES if size >= extent), SQUARE_SIZES[-1])
+    x, y = (x0 + x1) // 2, (y0 + y1) // 2
+    top_left = (max(x - square_size // 2, 0), max(y - square_size // 2, 0))
+    bottom_right = (min(x + square_size // 2, width), min(y + square_size // 2, height))
+    return (x, y), top_left, bottom_right
+
+def remove_overlapping(candidates, min_distance):
+    # Keeps the strongest candidate where several are closer than min_distance, candidates are sorted by score
+    kept = []
+    for candidate in candidates:
+        if all(abs(candidate["center"][0] - k["center"][0]) >= min_distance or abs(candidate["center"][1] - k["center"][1]) >= min_distance for k in kept):
+            kept.append(candidate)
+    return kept
+
+def read_manual_rows(csv_path):
+    # Rows of an existing roi csv that were not written by this detector, only exact detector descriptions are replaced
+    if not csv_path.is_file():
+        return []
+    with open(csv_path, newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None) # Header
+        return [row for row in reader if len(row) == len(CSV_HEADER) and not AUTO_DESCRIPTION_PATTERN.fullmatch(row[5])]
+
+def write_candidates_csv(csv_path, image_path, candidates, width, height):
+    rows = read_manual_rows(csv_path)
+    next_roi = max((int(row[1]) for row in rows if row[1].isdigit()), default=0) + 1
+
+    for i, candidate in enumerate(candidates):
+        (x, y), top_left, bottom_right = square_roi(candidate, width, height)
+        rows.append([image_path, next_roi + i, f"{x}_{y}", top_left, bottom_right, f"{AUTO_DESCRIPTION} {candidate['score']:.1f}"])
+
+    temporary_path = csv_path.with_suffix('.tmp')
+    with open(temporary_path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+    os.replace(temporary_path, csv_path) # Readers never see a half written file
+
+def detect_file(image_path, output_folder_path, side, max_candidates, settings):
+    image_path = Path(image_path)
+    image = read_grey_image(image_path)
+    side = side if side != 'auto' else side_from_name(image_path.stem)
+
+    candidates = detect_candidates(image, side=side, **settings)
+    candidates = remove_overlapping(candidates, min_distance=SQUARE_SIZES[0])[:max_candidates]
+
+    csv_path = output_folder_path / f"roi_{image_path.stem}.csv"
+    write_candidates_csv(csv_path, image_path, candidates, image.shape[1], image.shape[0])
+    return image_path.name, len(candidates)
+
+def select_images(image_paths):
+    # One image per stem, they share roi_<stem>.csv. Lossless tiff is preferred over e.g. the jpeg of the geotiff script
+    selected = {}
+    for image_path in sorted(image_paths, key=lambda path: IMAGE_SUFFIXES.index(path.suffix.lower())):
+        if image_path.stem in selected:
+            print(f"Skipping {image_path.name}, using {selected[image_path.stem].name} for roi_{image_path.stem}.csv")
+            continue
+        selected[image_path.stem] = image_path
+    return sorted(selected.values())
+
+def main(args):
+    input_path = Path(args.input)
+    output_folder = Path(args.output)
+
+    if input_path.is_dir():
+        image_paths = select_images(path for path in input_path.iterdir() if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES and not path.stem.endswith('_geotiff'))
+    elif input_path.is_file():
+        image_paths = [input_path]
+    else:
+        print(f"The provided path {input_path} does not exist.")
+        return
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+    settings = {"highlight_z": args.highlight_z, "shadow_z": args.shadow_z, "max_gap": args.max_gap}
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(detect_file, image_path, output_folder, args.side, args.max_candidates, settings) for image_path in image_paths]
+        for future in futures:
+            name, count = future.result()
+            print(f"{name}: {count} candidates")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Detect highlight/shadow target candidates in sonar images and write roi_<name>.csv for click_crop_tk.py.')
+    parser.add_argument('-i', '--input', default="tiffs", type=str, help='Image, or folder of images (converted lines).')
+    parser.add_argument('-o', '--output', default=".", type=str, help='Folder for roi csv files, click_crop_tk.py reads them from the working directory. (default .)')
+    parser.add_argument('-s', '--side', choices=['auto', 'starboard', 'port', 'both'], default='auto', type=str, help='Sonar side, shadows are searched further out in range. auto uses -S-/-P- in the file name. (default auto)')
+    parser.add_argument('-hz', '--highlight_z', default=3.0, type=float, help='Highlight threshold in background standard deviations. (default 3.0)')
+    parser.add_argument('-sz', '--shadow_z', default=1.5, type=float, help='Shadow threshold in background standard deviations. (default 1.5)')
+    parser.add_argument('-g', '--max_gap', default=150, type=int, help='Largest distance in pixels from highlight to shadow. (default 150)')
+    parser.add_argument('-n', '--max_candidates', default=200, type=int, help='Most candidates per line, strongest first. (default 200)')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help='Worker processes. (default CPU count)')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,144 @@
+"""
+Speckle reduction of sonar intensity (linear, before log scaling and quantization).
+Methods: boxcar multi-look (local mean), Lee (local statistics, multiplicative noise) and median.
+
+The image is split into along-track strips (rows are pings) with an overlap of half the window, and the strips are
+filtered in a thread pool. The kernels are whole-array numpy operations (cumulative sums, arithmetic, partition),
+which release the GIL, so the strips run in parallel.
+
+Run this file to measure scaling with the number of threads on a synthetic HiSAS sized line:
+speckle_filter.py -m lee -s 5
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+METHODS = ('boxcar', 'lee', 'median')
+DEFAULT_STRIP_ROWS = 256
+MEDIAN_BLOCK_COLUMNS = 1024 # Limits the size of the sliding window copy made by the median
+
+def window_sum(data, size):
+    # Sum over a size x size window around every pixel, from an integral image of the reflect padded data
+    pad = size // 2
+    padded = np.pad(data.astype(np.float64), pad, mode='reflect')
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.float64)
+    np.cumsum(padded, axis=0, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    return integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+
+def local_statistics(data, size):
+    # Local mean and variance in a size x size window
+    n = size * size
+    mean = window_sum(data, size) / n
+    mean_square = window_sum(np.square(data, dtype=np.float64), size) / n
+    variance = np.maximum(mean_square - np.square(mean), 0)
+    return mean, variance
+
+def boxcar(data, size):
+    # Multi-look by averaging size x size neighbouring pixels
+    return (window_sum(data, size) / (size * size)).astype(np.float32)
+
+def lee(data, size, looks=1.0):
+    """
+    Lee filter for multiplicative speckle. Homogeneous areas get the local mean, edges and targets keep their value.
+
+    Parameters:
+      data (ndarray): Linear intensity.
+      size (int): Window size, odd.
+      looks (float): Equivalent number of looks of the input, speckle coefficient of variation is 1/sqrt(looks).
+    """
+    mean, variance = local_statistics(data, size)
+    noise_cv_square = 1.0 / looks
+    with np.errstate(divide='ignore', invalid='ignore'):
+        local_cv_square = variance / np.square(mean)
+        weight = np.clip(1 - noise_cv_square / local_cv_square, 0, 1)
+    weight = np.nan_to_num(weight)
+    return (mean + weight * (data - mean)).astype(np.float32)
+
+def median(data, size):
+    # Median in a size x size window, done in column blocks to bound memory
+    pad = size // 2
+    padded = np.pad(data, pad, mode='reflect')
+    out = np.empty(data.shape, dtype=np.float32)
+    for start in range(0, data.shape[1], MEDIAN_BLOCK_COLUMNS):
+        stop = min(start + MEDIAN_BLOCK_COLUMNS, data.shape[1])
+        windows = np.lib.stride_tricks.sliding_window_view(padded[:, start:stop + 2 * pad], (size, size))
+        out[:, start:stop] = np.median(windows.reshape(windows.shape[0], windows.shape[1], -1), axis=-1)
+    return out
+
+def filter_strip(data, method, size, looks):
+    if method == 'boxcar':
+        return boxcar(data, size)
+    elif method == 'lee':
+        return lee(data, size, looks)
+    elif method == 'median':
+        return median(data, size)
+    raise ValueError(f"Unknown speckle filter {method}, use one of {METHODS}")
+
+def speckle_filter(data, method='lee', size=5, looks=1.0, threads=None, strip_rows=DEFAULT_STRIP_ROWS):
+    """
+    Filters a ping x sample intensity matrix in overlapping along-track strips on a thread pool.
+
+    Parameters:
+      data (ndarray): Linear intensity, one row per ping.
+      method (str): 'boxcar', 'lee' or 'median'.
+      size (int): Window size in pixels, must be odd.
+      looks (float): Equivalent number of looks, used by Lee.
+      threads (int): Number of threads, default CPU count.
+      strip_rows (int): Rows per strip, without overlap.
+
+    Returns:
+      ndarray: Filtered float32 matrix with the same shape.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown speckle filter {method}, use one of {METHODS}")
+    if size < 3 or size % 2 == 0:
+        raise ValueError(f"Speckle filter size must be odd and at least 3, is {size}")
+
+    data = np.asarray(data, dtype=np.float32)
+    rows = data.shape[0]
+    halo = size // 2
+    out = np.empty(data.shape, dtype=np.float32)
+
+    if rows <= 2 * halo or min(data.shape) <= halo: # Too small for reflect padding in strips
+        return filter_strip(np.pad(data, halo, mode='edge'), method, size, looks)[halo:-halo, halo:-halo]
+
+    def run(start):
+        stop = min(start + strip_rows, rows)
+        # Overlap with the neighbour strips so the window sees real rows, reflect padding only at the image edges
+        halo_start, halo_stop = max(start - halo, 0), min(stop + halo, rows)
+        filtered = filter_strip(data[halo_start:halo_stop], method, size, looks)
+        out[start:stop] = filtered[start - halo_start:start - halo_start + stop - start]
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as executor:
+        list(executor.map(run, range(0, rows, strip_rows)))
+
+    return out
+
+def benchmark(method, size, rows, cols):
+    # Times the filter with an increasing number of threads on exponential (single look) speckle
+    data = np.random.default_rng(0).exponential(1000, (rows, cols)).astype(np.float32)
+    cpu_count = os.cpu_count()
+    thread_counts = sorted({1, 2, 4, 8, 16, cpu_count} & set(range(1, cpu_count + 1)))
+
+    print(f"{method} {size}x{size} on {rows}x{cols}, {cpu_count} CPUs")
+    single = None
+    for threads in thread_counts:
+        start = time.perf_counter()
+        speckle_filter(data, method=method, size=size, threads=threads)
+        elapsed = time.perf_counter() - start
+        single = single or elapsed
+        print(f"{threads} threads: {elapsed:.2f} s, speedup {single / elapsed:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark speckle filter scaling with threads.')
+    parser.add_argument('-m', '--method', choices=METHODS, default='lee', type=str, help='Filter method. (default lee)')
+    parser.add_argument('-s', '--size', default=5, type=int, help='Window size, odd. (default 5)')
+    parser.add_argument('-r', '--rows', default=4000, type=int, help='Pings. (default 4000)')
+    parser.add_argument('-c', '--cols', default=13000, type=int, help='Samples per ping. (default 13000)')
+    args = parser.parse_args()
+
+    benchmark(args.method, args.size, args.rows, args.cols)
@@ -1,7 +1,7 @@
-import math
 import xml.etree.ElementTree as ET
 import rasterio
-from haversine import inverse_haversine, Unit
+
+import geodesy # Local vectorized geodesic helpers
 
 def degrees_to_centimeters(degree_value, latitude, for_longitude=True):
     """
@@ -15,14 +15,7 @@ def degrees_to_centimeters(degree_value, latitude, for_longitude=True):
     Returns:
       float: The approximate linear size in centimeters.
     """
-    # Approximate conversion constants (in meters per degree)
-    meters_per_degree_lat = 111320   # For latitude
-    meters_per_degree_lon = 111320 * math.cos(math.radians(latitude))  # For longitude
-    
-    if for_longitude:
-        meters = degree_value * meters_per_degree_lon
-    else:
-        meters = degree_value * meters_per_degree_lat
+    meters = geodesy.degrees_to_meters(degree_value, latitude, for_longitude)
 
     centimeters = meters * 100  # 1 m = 100 cm
     return centimeters
@@ -58,19 +51,13 @@ def write_pam_aux_xml(aux_xml_output, srs_txt, transform):
 
 def calculate_acoustic_bearing_radians(SensorHeading, BEARING_90_DEG_STARBOARD):
     # Calculate offset to sensor heading, this is acoustic bearing (radians), depends on channel port or starboard
-    acoustic_bearing_radians = None
-    if BEARING_90_DEG_STARBOARD:
-        acoustic_bearing_radians = math.radians(SensorHeading + 90)
-    else:
-        acoustic_bearing_radians = math.radians(SensorHeading - 90)
-
-    return acoustic_bearing_radians
+    # SensorHeading may be a single value or an array of headings
+    return geodesy.acoustic_bearing_radians(SensorHeading, BEARING_90_DEG_STARBOARD)
 
 def calculate_outermost_latlon(sensor_lat, sensor_lon, acoustic_bearing_radians, groundrange):
     # Calculate the latitude and longitude of the GroundRange outermost point, in the acoustic bearing
-    p1 = (sensor_lat, sensor_lon)
-    p2 = inverse_haversine(p1, groundrange, acoustic_bearing_radians, Unit.METERS)
-    return p2
+    # Accepts single values or arrays, one element per ping
+    return geodesy.inverse_haversine(sensor_lat, sensor_lon, groundrange, acoustic_bearing_radians)
 
 def create_gcps(sensor_pos_first_ping, sensor_pos_last_ping, outer_pos_first_ping, outer_pos_last_ping, is_starboard, height, width):
     # Create GroundControlPoint, four points used to translate the image pixels onto the map
@@ -7,7 +7,62 @@ import logging
 
 from pyxtf import xtf_read, concatenate_channel, XTFHeaderType, XTFChannelType
 
-def convert_xtf_tiff(file_path: str, output_folder_path: str, output_bitdepth: int, resize_half_width: bool, histogram_equalization: bool, column_threshold: int):
+import ping_store # Local chunked store of processed pings
+import ground_range # Local slant range to ground range correction
+import speckle_filter # Local multi-threaded speckle reduction
+
+def save_log_channel(np_chan, file_stem: str, output_folder_path: Path, output_bitdepth: int, resize_half_width: bool, histogram_equalization: bool, value_range: tuple = None):
+    # Scales a log10 ping x sample matrix to the output bitdepth and saves it as tiff
+    # Need to find minimum and maximum value for scaling, value_range overrides them (e.g. full resolution range for a preview)
+    vmin, vmax = value_range if value_range is not None else (np_chan.min(), np_chan.max())
+
+    print("Values before scaling; min, vmax", vmin, vmax)
+
+    # Scaling values to fit datatype uint16
+    np_chan = ((np_chan - vmin) / (vmax - vmin)) * 65535
+    np_chan = np.clip(np_chan, 0, 65535)
+
+    if histogram_equalization:
+        #np_chan = cv2.equalizeHist(np_chan)
+        hist, bins = np.histogram(np_chan.flatten(), bins=65536, range=(0, 65536))
+        cdf = hist.cumsum()
+        cdf_normalized = cdf / cdf.max()  # Normalize CDF
+        equalized_img = np.interp(np_chan.flatten(), bins[:-1], cdf_normalized * 65535).astype(np.uint16)
+        np_chan = equalized_img.reshape(np_chan.shape)
+
+    # Resample as necessary after histogram equalization, it is already in uin16
+
+    # With a given value_range the uint16 scale is kept, so the preview is not stretched to its own min and max
+    vmin, vmax = (0, 65535) if value_range is not None else (np_chan.min(), np_chan.max())
+
+    print("Values before saving; min, vmax", vmin, vmax)
+
+    img = None
+
+    if output_bitdepth == 8: # Scaling values to fit datatype uint8
+        np_chan = ((np_chan - vmin) / (vmax - vmin)) * 255
+        np_chan = np.clip(np_chan, 0, 255)
+        img = Image.fromarray(np_chan.astype(np.uint8))
+
+    elif output_bitdepth == 16: # Scaling values to fit datatype uint16
+        #np_chan = ((np_chan - vmin) / (vmax - vmin)) * 65535
+        #np_chan = np.clip(np_chan, 0, 65535)
+        img = Image.fromarray(np_chan.astype(np.uint16))
+
+    else:
+        exit("Invalid requested bit depth")
+
+    print("resize_half_width", resize_half_width)
+    if resize_half_width:
+        print("Half width resize")
+        img = img.resize((int(img.size[0]/2), img.size[1]), Image.Resampling.LANCZOS)
+
+    output_filename = f'{file_stem}.tiff'
+    output_folder_path.mkdir(parents=True, exist_ok=True)
+    print(f"Saving file {output_folder_path / output_filename}, width {img.size[0]}, height {img.size[1]}")
+    img.save(output_folder_path / output_filename)
+
+def convert_xtf_tiff(file_path: str, output_folder_path: str, output_bitdepth: int, resize_half_width: bool, histogram_equalization: bool, column_threshold: int, ground_range_correction: bool = False, speckle_method: str = None, speckle_size: int = 5):
     filename = file_path.name # full filename
     file_stem = file_path.stem # only filename
     file_suffix = file_path.suffix # only extension
@@ -49,6 +104,12 @@ def convert_xtf_tiff(file_path: str, output_folder_path: str, output_bitdepth: i
         logging.info(f"Concatenating pings in channel")
         np_chan = concatenate_channel(p[XTFHeaderType.sonar], file_header=fh, channel=0, weighted=True)
 
+        if ground_range_correction:
+            logging.info(f"Resampling pings from slant range to ground range")
+            np_chan.clip(0, upper_limit - 1, out=np_chan) # Same values as in the ping store, so -s gives the same result
+            slant_ranges, ground_ranges, altitudes = ground_range.ping_geometry_from_pings(p[XTFHeaderType.sonar])
+            np_chan = ground_range.slant_to_ground_range(np_chan, slant_ranges, ground_ranges, altitudes, is_starboard=starboard)
+
         #for ping in p[XTFHeaderType.sonar]:
             #print(ping)
             #print(ping.ping_chan_headers[0])
@@ -79,59 +140,74 @@ def convert_xtf_tiff(file_path: str, output_folder_path: str, output_bitdepth: i
         # Clip to range (max cannot be used due to outliers)
         # More robust methods are possible (through histograms / statistical outlier removal)
         np_chan.clip(0, upper_limit - 1, out=np_chan)
+
+        # Speckle reduction works on linear intensity, before the dynamic range is compressed
+        if speckle_method:
+            logging.info(f"Speckle filter {speckle_method} {speckle_size}x{speckle_size}")
+            np_chan = speckle_filter.speckle_filter(np_chan, method=speckle_method, size=speckle_size)
         
         # The sonar data is logarithmic (dB), add small value to avoid log10(0)
         np_chan = np.log10(np_chan + 1, dtype=np.float32)
 
-        # Need to find minimum and maximum value for scaling
-        vmin = np_chan.min()
-        vmax = np_chan.max()
-
-        print("Values before scaling; min, vmax", vmin, vmax)
-        
-        # Scaling values to fit datatype uint16
-        np_chan = ((np_chan - vmin) / (vmax - vmin)) * 65535
-        np_chan = np.clip(np_chan, 0, 65535)
-
-        if histogram_equalization:
-            #np_chan = cv2.equalizeHist(np_chan)
-            hist, bins = np.histogram(np_chan.flatten(), bins=65536, range=(0, 65536))
-            cdf = hist.cumsum()
-            cdf_normalized = cdf / cdf.max()  # Normalize CDF
-            equalized_img = np.interp(np_chan.flatten(), bins[:-1], cdf_normalized * 65535).astype(np.uint16)
-            np_chan = equalized_img.reshape(np_chan.shape)
-
-        # Resample as necessary after histogram equalization, it is already in uin16
+        save_log_channel(np_chan, file_stem, output_folder_path, output_bitdepth, resize_half_width, histogram_equalization)
 
-        vmin = np_chan.min()
-        vmax = np_chan.max()
+def convert_store_tiff(file_path: Path, output_folder_path: Path, output_bitdepth: int, resize_half_width: bool, histogram_equalization: bool, column_threshold: int, store_folder_path: Path, ground_range_correction: bool = False, speckle_method: str = None, speckle_size: int = 5, store_level: int = 0):
+    # Same output as convert_xtf_tiff, but reads the log-scaled pings from the ping store, built once per XTF
+    # store_level > 0 reads a downsampled pyramid level, for previews at 1/2, 1/4, ... of the size
+    store = ping_store.open_or_build_store(file_path, store_folder_path)
 
-        print("Values before saving; min, vmax", vmin, vmax)
+    if store_level >= store.level_count:
+        print(f"Store has levels 0 to {store.level_count - 1}, using {store.level_count - 1}")
+        store_level = store.level_count - 1
 
-        img = None
-
-        if output_bitdepth == 8: # Scaling values to fit datatype uint8
-            np_chan = ((np_chan - vmin) / (vmax - vmin)) * 255
-            np_chan = np.clip(np_chan, 0, 255)
-            img = Image.fromarray(np_chan.astype(np.uint8))
+    is_starboard = store.source["is_starboard"]
+    if is_starboard is None:
+        exit("Unknown XTF channel type")
+    print("XTF Channel is Starboard" if is_starboard else "XTF Channel is Port")
+
+    level_cols = store.level_shape(store_level)[1]
+    scale = 2 ** store_level
+    print("Columns before cleanup:", level_cols)
+
+    if ground_range_correction:
+        # Resampling needs whole pings, and is done on linear values like convert_xtf_tiff, the store holds log10(value + 1)
+        # Column means are recomputed on the ground range axis
+        logging.info(f"Resampling pings from slant range to ground range")
+        slant_ranges, ground_ranges, altitudes = ground_range.ping_geometry_from_headers(*store.level_ping_headers(store_level))
+        np_chan = ground_range.slant_to_ground_range(np.power(10, store.read(level=store_level), dtype=np.float32) - 1, slant_ranges, ground_ranges, altitudes, is_starboard=is_starboard)
+        kept_columns = np.where(np.mean(np_chan, axis=0) >= column_threshold)[0]
+        np_chan = np.log10(np_chan[:, kept_columns] + 1, dtype=np.float32)
+        full_resolution_columns = slice(None)
+    else:
+        # Start cutting columns where average value is below column_threshold, used to remove black sides
+        # Only chunks between the first and last kept column are read from the store
+        kept_columns = np.where(store.level_column_mean(store_level) >= column_threshold)[0]
+        if len(kept_columns) > 0:
+            first_column, last_column = kept_columns[0], kept_columns[-1] + 1
+            np_chan = store.read(cols=slice(first_column, last_column), level=store_level)
+            np_chan = np_chan[:, kept_columns - first_column]
+            full_resolution_columns = slice(first_column * scale, last_column * scale)
+
+    if len(kept_columns) == 0:
+        print("No columns above column_threshold, nothing to save")
+        return
 
-        elif output_bitdepth == 16: # Scaling values to fit datatype uint16
-            #np_chan = ((np_chan - vmin) / (vmax - vmin)) * 65535
-            #np_chan = np.clip(np_chan, 0, 65535)
-            img = Image.fromarray(np_chan.astype(np.uint16))
+    logging.info(f"Removing {level_cols - len(kept_columns)} columns with value below column_threshold={column_threshold}")
+    print("Columns after cleanup:", np_chan.shape[1])
 
-        else:
-            exit("Invalid requested bit depth")
+    # Speckle reduction works on linear intensity, the store holds log10(value + 1)
+    if speckle_method:
+        logging.info(f"Speckle filter {speckle_method} {speckle_size}x{speckle_size}")
+        np_chan = np.power(10, np_chan, dtype=np.float32) - 1
+        np_chan = np.log10(speckle_filter.speckle_filter(np_chan, method=speckle_method, size=speckle_size) + 1, dtype=np.float32)
 
-        print("resize_half_width", resize_half_width)
-        if resize_half_width:
-            print("Half width resize")
-            img = img.resize((int(img.size[0]/2), img.size[1]), Image.Resampling.LANCZOS)
+    # Averaging in the pyramid narrows the value range, so a preview is scaled with the full resolution range of the
+    # chunks it covers (chunk statistics, nothing is decompressed) and gets the same contrast as the full product
+    value_range = None
+    if store_level > 0 and not speckle_method:
+        value_range = store.value_range(cols=full_resolution_columns)
 
-        output_filename = f'{file_stem}.tiff'
-        output_folder_path.mkdir(parents=True, exist_ok=True)
-        print(f"Saving file {output_folder_path / output_filename}, width {img.size[0]}, height {img.size[1]}")
-        img.save(output_folder_path / output_filename)
+    save_log_channel(np_chan, file_path.stem, output_folder_path, output_bitdepth, resize_half_width, histogram_equalization, value_range=value_range)
 
 def main(args):
 
@@ -140,12 +216,11 @@ def main(args):
     arg_bitdepth = args.bitdepth
     arg_column_threshold = args.column_threshold
 
-    arg_resize_half_width = None
-
-    if args.resize_half_width:
-        arg_resize_half_width = True
+    # Ground range correction already gives equally spaced columns, so the half width resize is off with it unless asked for
+    if args.resize_half_width is None:
+        arg_resize_half_width = not args.ground_range
     else:
-        arg_resize_half_width = False
+        arg_resize_half_width = args.resize_half_width
     
     arg_histogram_equalization = None
     if args.histogram_equalization:
@@ -167,7 +242,10 @@ def main(args):
         #logging.info(f"Processing file: {file_path}")
         if file_path.is_file():
             print(f"Processing file: {file_path}")
-            convert_xtf_tiff(file_path=file_path, output_folder_path=output_folder, output_bitdepth=arg_bitdepth, resize_half_width=arg_resize_half_width, histogram_equalization=arg_histogram_equalization, column_threshold=arg_column_threshold)
+            if args.store:
+                convert_store_tiff(file_path=file_path, output_folder_path=output_folder, output_bitdepth=arg_bitdepth, resize_half_width=arg_resize_half_width, histogram_equalization=arg_histogram_equalization, column_threshold=arg_column_threshold, store_folder_path=Path(args.store), ground_range_correction=args.ground_range, speckle_method=args.speckle_filter, speckle_size=args.speckle_size, store_level=args.store_level)
+            else:
+                convert_xtf_tiff(file_path=file_path, output_folder_path=output_folder, output_bitdepth=arg_bitdepth, resize_half_width=arg_resize_half_width, histogram_equalization=arg_histogram_equalization, column_threshold=arg_column_threshold, ground_range_correction=args.ground_range, speckle_method=args.speckle_filter, speckle_size=args.speckle_size)
             print("\n")
 
 if __name__ == "__main__":
@@ -175,10 +253,15 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--input', default="xtfs", type=str, help='Input folder.')
     parser.add_argument('-o', '--output', default="tiffs", type=str, help='Output folder.')
     parser.add_argument('-b', '--bitdepth', choices=[8,16], default=8, type=int, help='Bitdepth of output image, must be of the allowed values: 8 (default), 16.')
-    parser.add_argument('-rhw', '--resize_half_width', default=True, action='store_true', help='Resize to half width. (default True)')
+    parser.add_argument('-rhw', '--resize_half_width', default=None, action=argparse.BooleanOptionalAction, help='Resize to half width, --no-resize_half_width to keep full width. (default True, False with -gr)')
     parser.add_argument('-v', '--verbose', default=False, action='store_true', help='Verbose mode.')
     parser.add_argument('-heq', '--histogram_equalization', default=False, action='store_true', help='Histogram equalization. (default False)')
     parser.add_argument('-cth', '--column_threshold', default=7, type=int, help='Column threshold, avg col val to cut from data. Typical 0 to 7 (default). Set to -1 to disable')
+    parser.add_argument('-s', '--store', default=None, type=str, help='Ping store folder. Builds a chunked store per XTF once and converts from it. (default off)')
+    parser.add_argument('-sl', '--store_level', default=0, type=int, help='Pyramid level to convert from with -s, each level halves width and height, for previews. (default 0, full resolution)')
+    parser.add_argument('-gr', '--ground_range', default=False, action='store_true', help='Slant range to ground range correction, from SlantRange, GroundRange and SensorPrimaryAltitude of each ping. (default False)')
+    parser.add_argument('-sf', '--speckle_filter', choices=speckle_filter.METHODS, default=None, type=str, help='Speckle reduction before log scaling: boxcar (multi-look), lee or median. (default off)')
+    parser.add_argument('-sfs', '--speckle_size', default=5, type=int, help='Speckle filter window size, odd. (default 5)')
     args = parser.parse_args()
     
     main(args)
\ No newline at end of file
@@ -0,0 +1,297 @@
+"""
+Metadata-only reading of XTF files.
+Walks the file packet to packet and reads only the fixed-size file, ping and channel headers, sample payloads are skipped.
+Layouts follow the Triton XTF format specification (packed, little endian), same as the ctypes structures in pyxtf.
+"""
+
+import mmap
+import struct
+import logging
+import numpy as np
+from pathlib import Path
+
+XTF_MAGIC_NUMBER = 0xFACE
+XTF_HEADER_SONAR = 0 # Same value as pyxtf.XTFHeaderType.sonar
+
+FILE_HEADER_SIZE = 1024 # Holds ChanInfo for 6 channels, grows in 1024 byte blocks of 8 channels
+PACKET_START_SIZE = 14
+PING_HEADER_SIZE = 256 # Including the packet start
+PING_CHAN_HEADER_SIZE = 64
+
+chan_info_dtype = np.dtype([
+    ('TypeOfChannel', '<u1'),
+    ('SubChannelNumber', '<u1'),
+    ('CorrectionFlags', '<u2'),
+    ('UniPolar', '<u2'),
+    ('BytesPerSample', '<u2'),
+    ('Reserved', '<u4'),
+    ('ChannelName', 'S16'),
+    ('VoltScale', '<f4'),
+    ('Frequency', '<f4'),
+    ('HorizBeamAngle', '<f4'),
+    ('TiltAngle', '<f4'),
+    ('BeamWidth', '<f4'),
+    ('OffsetX', '<f4'),
+    ('OffsetY', '<f4'),
+    ('OffsetZ', '<f4'),
+    ('OffsetYaw', '<f4'),
+    ('OffsetPitch', '<f4'),
+    ('OffsetRoll', '<f4'),
+    ('BeamsPerArray', '<u2'),
+    ('SampleFormat', '<u1'),
+    ('ReservedArea2', 'S53'),
+])
+
+file_header_dtype = np.dtype([
+    ('FileFormat', '<u1'),
+    ('SystemType', '<u1'),
+    ('RecordingProgramName', 'S8'),
+    ('RecordingProgramVersion', 'S8'),
+    ('SonarName', 'S16'),
+    ('SonarType', '<u2'),
+    ('NoteString', 'S64'),
+    ('ThisFileName', 'S64'),
+    ('NavUnits', '<u2'),
+    ('NumberOfSonarChannels', '<u2'),
+    ('NumberOfBathymetryChannels', '<u2'),
+    ('NumberOfSnippetChannels', '<u1'),
+    ('NumberOfForwardLookArrays', '<u1'),
+    ('NumberOfEchoStrengthChannels', '<u2'),
+    ('NumberOfInterferometryChannels', '<u1'),
+    ('Reserved1', '<u1'),
+    ('Reserved2', '<u2'),
+    ('ReferencePointHeight', '<f4'),
+    ('ProjectionType', 'S12'),
+    ('SpheriodType', 'S10'),
+    ('NavigationLatency', '<i4'),
+    ('OriginY', '<f4'),
+    ('OriginX', '<f4'),
+    ('NavOffsetY', '<f4'),
+    ('NavOffsetX', '<f4'),
+    ('NavOffsetZ', '<f4'),
+    ('NavOffsetYaw', '<f4'),
+    ('MRUOffsetY', '<f4'),
+    ('MRUOffsetX', '<f4'),
+    ('MRUOffsetZ', '<f4'),
+    ('MRUOffsetYaw', '<f4'),
+    ('MRUOffsetPitch', '<f4'),
+    ('MRUOffsetRoll', '<f4'),
+    ('ChanInfo', chan_info_dtype, (6,)),
+])
+
+ping_header_dtype = np.dtype([
+    ('MagicNumber', '<u2'),
+    ('HeaderType', '<u1'),
+    ('SubChannelNumber', '<u1'),
+    ('NumChansToFollow', '<u2'),
+    ('Reserved1', '<u2', (2,)),
+    ('NumBytesThisRecord', '<u4'),
+    ('Year', '<u2'),
+    ('Month', '<u1'),
+    ('Day', '<u1'),
+    ('Hour', '<u1'),
+    ('Minute', '<u1'),
+    ('Second', '<u1'),
+    ('HSeconds', '<u1'),
+    ('JulianDay', '<u2'),
+    ('EventNumber', '<u4'),
+    ('PingNumber', '<u4'),
+    ('SoundVelocity', '<f4'),
+    ('OceanTide', '<f4'),
+    ('Reserved2', '<u4'),
+    ('ConductivityFreq', '<f4'),
+    ('TemperatureFreq', '<f4'),
+    ('PressureFreq', '<f4'),
+    ('PressureTemp', '<f4'),
+    ('Conductivity', '<f4'),
+    ('WaterTemperature', '<f4'),
+    ('Pressure', '<f4'),
+    ('ComputedSoundVelocity', '<f4'),
+    ('MagX', '<f4'),
+    ('MagY', '<f4'),
+    ('MagZ', '<f4'),
+    ('AuxVal1', '<f4'),
+    ('AuxVal2', '<f4'),
+    ('AuxVal3', '<f4'),
+    ('AuxVal4', '<f4'),
+    ('AuxVal5', '<f4'),
+    ('AuxVal6', '<f4'),
+    ('SpeedLog', '<f4'),
+    ('Turbidity', '<f4'),
+    ('ShipSpeed', '<f4'),
+    ('ShipGyro', '<f4'),
+    ('ShipYcoordinate', '<f8'),
+    ('ShipXcoordinate', '<f8'),
+    ('ShipAltitude', '<u2'),
+    ('ShipDepth', '<u2'),
+    ('FixTimeHour', '<u1'),
+    ('FixTimeMinute', '<u1'),
+    ('FixTimeSecond', '<u1'),
+    ('FixTimeHsecond', '<u1'),
+    ('SensorSpeed', '<f4'),
+    ('KP', '<f4'),
+    ('SensorYcoordinate', '<f8'),
+    ('SensorXcoordinate', '<f8'),
+    ('SonarStatus', '<u2'),
+    ('RangeToFish', '<u2'),
+    ('BearingToFish', '<u2'),
+    ('CableOut', '<u2'),
+    ('Layback', '<f4'),
+    ('CableTension', '<f4'),
+    ('SensorDepth', '<f4'),
+    ('SensorPrimaryAltitude', '<f4'),
+    ('SensorAuxAltitude', '<f4'),
+    ('SensorPitch', '<f4'),
+    ('SensorRoll', '<f4'),
+    ('SensorHeading', '<f4'),
+    ('Heave', '<f4'),
+    ('Yaw', '<f4'),
+    ('AttitudeTimeTag', '<u4'),
+    ('DOT', '<f4'),
+    ('NavFixMilliseconds', '<u4'),
+    ('ComputerClockHour', '<u1'),
+    ('ComputerClockMinute', '<u1'),
+    ('ComputerClockSecond', '<u1'),
+    ('ComputerClockHsec', '<u1'),
+    ('FishPositionDeltaX', '<i2'),
+    ('FishPositionDeltaY', '<i2'),
+    ('FishPositionErrorCode', '<u1'),
+    ('OptionalOffset', '<u4'),
+    ('CableOutHundredths', '<u1'),
+    ('ReservedSpace2', '<u1', (6,)),
+])
+
+ping_chan_header_dtype = np.dtype([
+    ('ChannelNumber', '<u2'),
+    ('DownsampleMethod', '<u2'),
+    ('SlantRange', '<f4'),
+    ('GroundRange', '<f4'),
+    ('TimeDelay', '<f4'),
+    ('TimeDuration', '<f4'),
+    ('SecondsPerPing', '<f4'),
+    ('ProcessingFlags', '<u2'),
+    ('Frequency', '<u2'),
+    ('InitialGainCode', '<u2'),
+    ('GainCode', '<u2'),
+    ('BandWidth', '<u2'),
+    ('ContactNumber', '<u4'),
+    ('ContactClassification', '<u2'),
+    ('ContactSubNumber', '<u1'),
+    ('ContactType', '<u1'),
+    ('NumSamples', '<u4'),
+    ('MillivoltScale', '<u2'),
+    ('ContactTimeOffTrack', '<f4'),
+    ('ContactCloseNumber', '<u1'),
+    ('Reserved2', '<u1'),
+    ('FixedVSOP', '<f4'),
+    ('Weight', '<i2'),
+    ('ReservedSpace', '<u1', (4,)),
+])
+
+assert file_header_dtype.itemsize == FILE_HEADER_SIZE
+assert ping_header_dtype.itemsize == PING_HEADER_SIZE
+assert ping_chan_header_dtype.itemsize == PING_CHAN_HEADER_SIZE
+
+def number_of_channels(file_header):
+    # Same sum as pyxtf XTFFileHeader.channel_count()
+    return int(file_header['NumberOfSonarChannels'] + file_header['NumberOfBathymetryChannels'] +
+               file_header['NumberOfSnippetChannels'] + file_header['NumberOfForwardLookArrays'] +
+               file_header['NumberOfEchoStrengthChannels'] + file_header['NumberOfInterferometryChannels'])
+
+def file_header_size(n_channels):
+    # The first 1024 bytes fit 6 ChanInfo, each extra 1024 byte block fits 8 more
+    if n_channels <= 6:
+        return FILE_HEADER_SIZE
+    return FILE_HEADER_SIZE + int(np.ceil((n_channels - 6) / 8)) * FILE_HEADER_SIZE
+
+def read_chan_info(file_path, file_header):
+    """
+    Reads the ChanInfo of every channel, the first 6 are in the file header and the rest in the extra 1024 byte blocks after it.
+
+    Returns:
+      ndarray: chan_info_dtype array, shorter than number_of_channels(file_header) if the file is truncated.
+    """
+    n_channels = number_of_channels(file_header)
+    chan_info = file_header['ChanInfo'][:min(n_channels, 6)].copy()
+    if n_channels <= 6:
+        return chan_info
+
+    with open(file_path, 'rb') as f:
+        f.seek(FILE_HEADER_SIZE)
+        raw = f.read(file_header_size(n_channels) - FILE_HEADER_SIZE)
+    extra = np.frombuffer(raw, dtype=chan_info_dtype, count=min(n_channels - 6, len(raw) // chan_info_dtype.itemsize))
+    return np.concatenate((chan_info, extra))
+
+def read_ping_headers(file_path, header_type=XTF_HEADER_SONAR):
+    """
+    Reads the file header, and the ping header plus first channel header of every packet of the given type.
+
+    Parameters:
+      file_path (str or Path): XTF file.
+      header_type (int): Packet HeaderType to collect, default sonar.
+
+    Returns:
+      tuple: (file_header, ping_headers, ping_chan_headers) as numpy structured arrays, one element per ping.
+
+    Raises:
+      ValueError: If the file is too small to hold a file header.
+    """
+    file_path = Path(file_path)
+    header_length = PING_HEADER_SIZE + PING_CHAN_HEADER_SIZE
+
+    if file_path.stat().st_size < FILE_HEADER_SIZE:
+        raise ValueError(f"{file_path.name} is {file_path.stat().st_size} bytes, too small for an XTF file header")
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        file_header = np.frombuffer(mm, dtype=file_header_dtype, count=1)[0].copy()
+        offset = file_header_size(number_of_channels(file_header))
+
+        # Walk the packet starts only, the pages holding sample payloads are never touched
+        ping_offsets = []
+        file_size = len(mm)
+        while offset + PACKET_START_SIZE <= file_size:
+            magic, p_type, _, _, _, _, n_bytes = struct.unpack_from('<HBBHHHI', mm, offset)
+            if magic != XTF_MAGIC_NUMBER or n_bytes < PACKET_START_SIZE:
+                logging.warning(f"Invalid packet at byte {offset} in {file_path.name}, stopping") # Not stdout, xtfinfo prints JSON there
+                break
+            if p_type == header_type and offset + header_length <= file_size:
+                ping_offsets.append(offset)
+            offset += n_bytes
+
+        # Gather all headers at once, then reinterpret the bytes as structured arrays
+        raw = np.frombuffer(mm, dtype=np.uint8)
+        index = np.asarray(ping_offsets, dtype=np.int64)[:, None] + np.arange(header_length)
+        headers = raw[index]
+        del raw # Release the buffer export before the mmap is closed
+
+    ping_headers = np.ascontiguousarray(headers[:, :PING_HEADER_SIZE]).view(ping_header_dtype)[:, 0]
+    ping_chan_headers = np.ascontiguousarray(headers[:, PING_HEADER_SIZE:]).view(ping_chan_header_dtype)[:, 0]
+    return file_header, ping_headers, ping_chan_headers
+
+def ping_times(ping_headers):
+    # Vectorized datetime64[ms] from the Year, Month, Day, Hour, Minute, Second and HSeconds fields
+    dates = (ping_headers['Year'].astype(np.int64) - 1970).astype('datetime64[Y]')
+    dates = dates.astype('datetime64[M]') + (ping_headers['Month'].astype(np.int64) - 1).astype('timedelta64[M]')
+    dates = dates.astype('datetime64[D]') + (ping_headers['Day'].astype(np.int64) - 1).astype('timedelta64[D]')
+    milliseconds = (ping_headers['Hour'].astype(np.int64) * 3600000 + ping_headers['Minute'].astype(np.int64) * 60000 +
+                    ping_headers['Second'].astype(np.int64) * 1000 + ping_headers['HSeconds'].astype(np.int64) * 10)
+    return dates.astype('datetime64[ms]') + milliseconds.astype('timedelta64[ms]')
+
+def is_starboard_channel(file_header, channel=0):
+    """
+    Detects port or starboard from the channel name, falling back to TypeOfChannel (1 port, 2 starboard, as pyxtf XTFChannelType).
+
+    Returns:
+      bool or None: True for starboard, False for port, None if unknown.
+    """
+    chan_info = file_header['ChanInfo'][channel]
+    channel_name = chan_info['ChannelName'].decode(errors='replace').lower()
+    if 'starboard' in channel_name:
+        return True
+    elif 'port' in channel_name:
+        return False
+    elif chan_info['TypeOfChannel'] == 2:
+        return True
+    elif chan_info['TypeOfChannel'] == 1:
+        return False
+    return None
@@ -1,7 +1,10 @@
 """
 Example of how to convert a single-channel sonar sidescan XTF file to a georeferenced tiff and jpeg with sidecar-files.
-Toggle resize_half_width if your image width needs to be resized to half width.
+Toggle resize_half_width if your image width needs to be resized to half width, it is off with ground range correction.
 Toggle concatenate_channel weighted argument to fit your data requirements.
+Toggle ground_range_correction to resample pings from slant range to ground range before scaling.
+Toggle use_ping_store to read the processed pings from a ping store (see ping_store.py), built once per XTF.
+Set ping_store_level above 0 to georeference a downsampled pyramid level of the store, for previews.
 """
 
 import numpy as np
@@ -12,14 +15,20 @@ from pathlib import Path
 import pyxtf
 
 import utils # Local utility-file
+import ping_store # Local chunked store of processed pings
+import ground_range # Local slant range to ground range correction
 
 filename = Path("sasi-S-upper-20240314-110644-wrk_l1.xtf")
 file_stem = filename.stem
 xtf_input = Path(f"xtfs/{filename}") # Input XTF file
 
 bitdepth = 8 # Use 8 or 16 bits to store the pixel values
-resize_half_width = True # Resize image, half width
 weighted = True # Toggle concatenate_channel weighted argument to fit your data input requirements
+ground_range_correction = False # Resample pings from slant range to ground range, using each ping's altitude
+resize_half_width = not ground_range_correction # Resize image, half width. Ground range correction already gives equally spaced columns
+use_ping_store = False # Read pings from the ping store in ping_store_path instead of decoding the XTF every run
+ping_store_path = Path("stores")
+ping_store_level = 0 # Pyramid level read from the store, each level halves width and height
 
 # Output filepaths
 output_path = Path(f"output")
@@ -43,19 +52,22 @@ def calculate_outermost_latlon_from_ping(file_header: pyxtf.XTFFileHeader, ping_
     outermost_lat, outermost_lon = utils.calculate_outermost_latlon(sensor_lat, sensor_lon, acoustic_bearing_radians, GroundRange)
     return sensor_lat, sensor_lon, outermost_lat, outermost_lon
 
-def make_sidescan_sonar_image(fh, p, bitdepth=8, resize_half_width=False, weighted=False):
-    # make_sonar_image()
-    # Will read any bitdepth that pyxtf accepts and scale values to 8 or 16 bits
+def calculate_outermost_latlon_from_store(store: ping_store.PingStore, index: int, is_starboard=None):
+    # Same as calculate_outermost_latlon_from_ping, from the ping headers kept in the store
+    ping_header = store.ping_headers[index]
+    sensor_lat, sensor_lon = ping_header['SensorYcoordinate'], ping_header['SensorXcoordinate']
+    acoustic_bearing_radians = utils.calculate_acoustic_bearing_radians(ping_header['SensorHeading'], is_starboard)
+    GroundRange = store.ping_chan_headers[index]['GroundRange']
+
+    outermost_lat, outermost_lon = utils.calculate_outermost_latlon(sensor_lat, sensor_lon, acoustic_bearing_radians, GroundRange)
+    return sensor_lat, sensor_lon, outermost_lat, outermost_lon
 
+def log_chan_to_image(np_chan, bitdepth=8, resize_half_width=False, value_range=None):
+    # Scales log10 values to 8 or 16 bits, between value_range if given or else the min and max of the data
     upper_limit_16bit = 2 ** 16 - 1 # 0-65535
     upper_limit_8bit = 2 ** 8 - 1 # 0-255
 
-    np_chan = pyxtf.concatenate_channel(p[pyxtf.XTFHeaderType.sonar], file_header=fh, channel=0, weighted=weighted)
-    np_chan.clip(0, upper_limit_16bit, out=np_chan) # Clipping values outside valid range
-    np_chan = np.log10(np_chan + 1, dtype=np.float32)
-
-    vmin = np_chan.min()
-    vmax = np_chan.max()
+    vmin, vmax = value_range if value_range is not None else (np_chan.min(), np_chan.max())
 
     if bitdepth==8:
         np_chan = ((np_chan - vmin) / (vmax - vmin)) * upper_limit_8bit # Scaling values to fit datatype uint8
@@ -74,9 +86,54 @@ def make_sidescan_sonar_image(fh, p, bitdepth=8, resize_half_width=False, weight
 
     return img
 
-(fh, p) = pyxtf.xtf_read(xtf_input)
+def make_sidescan_sonar_image(fh, p, bitdepth=8, resize_half_width=False, weighted=False, ground_range_correction=False, is_starboard=True):
+    # make_sonar_image()
+    # Will read any bitdepth that pyxtf accepts and scale values to 8 or 16 bits
+
+    upper_limit_16bit = 2 ** 16 - 1 # 0-65535
+
+    np_chan = pyxtf.concatenate_channel(p[pyxtf.XTFHeaderType.sonar], file_header=fh, channel=0, weighted=weighted)
+    np_chan.clip(0, upper_limit_16bit, out=np_chan) # Clipping values outside valid range
+    if ground_range_correction:
+        slant_ranges, ground_ranges, altitudes = ground_range.ping_geometry_from_pings(p[pyxtf.XTFHeaderType.sonar])
+        np_chan = ground_range.slant_to_ground_range(np_chan, slant_ranges, ground_ranges, altitudes, is_starboard=is_starboard)
+    np_chan = np.log10(np_chan + 1, dtype=np.float32)
+
+    return log_chan_to_image(np_chan, bitdepth=bitdepth, resize_half_width=resize_half_width)
+
+if use_ping_store:
+    store = ping_store.open_or_build_store(xtf_input, ping_store_path, weighted=weighted)
+
+    if store.source["nav_units"] != 3: # If 0, then SensorYcoordinate and SensorXcoordinate is in meters. If 3, then in Lat/Long
+        print("NavUnits != 3, coordinates are in meters. Not implemented yet.")
+        exit(-1)
+
+    is_starboard = store.source["is_starboard"]
+    if is_starboard is None:
+        print("Unable to detect port or starboard in channel name.")
+        exit(-1)
+    print("Data detected as", "starboard" if is_starboard else "port")
+
+    np_chan = store.read(level=ping_store_level)
+    if ground_range_correction: # Resampled on linear values like make_sidescan_sonar_image, the store holds log10(value + 1)
+        slant_ranges, ground_ranges, altitudes = ground_range.ping_geometry_from_headers(*store.level_ping_headers(ping_store_level))
+        np_chan = ground_range.slant_to_ground_range(np.power(10, np_chan, dtype=np.float32) - 1, slant_ranges, ground_ranges, altitudes, is_starboard=is_starboard)
+        np_chan = np.log10(np_chan + 1, dtype=np.float32)
+    # A downsampled level is scaled with the full resolution range from the chunk statistics, for the same contrast
+    value_range = store.value_range() if ping_store_level > 0 else None
+    sonar_image = log_chan_to_image(np_chan, bitdepth=bitdepth, resize_half_width=resize_half_width, value_range=value_range)
+
+    # The last row of a level covers the pings up to rows * 2 ** level, an odd last ping is dropped by the pyramid
+    last_ping_index = store.level_shape(ping_store_level)[0] * 2 ** ping_store_level - 1
+    fp_s_lat, fp_s_lon, fp_o_lat, fp_o_lon = calculate_outermost_latlon_from_store(store, 0, is_starboard)
+    lp_s_lat, lp_s_lon, lp_o_lat, lp_o_lon = calculate_outermost_latlon_from_store(store, last_ping_index, is_starboard)
+else:
+    (fh, p) = pyxtf.xtf_read(xtf_input)
+
+    if pyxtf.XTFHeaderType.sonar not in p:
+        print("No sonar data in file")
+        exit(-1)
 
-if pyxtf.XTFHeaderType.sonar in p:
     n_channels = fh.channel_count(verbose=True)
 
     if n_channels > 1:
@@ -100,13 +157,7 @@ if pyxtf.XTFHeaderType.sonar in p:
         print("Unable to detect port or starboard in channel name.")
         exit(-1)
 
-    sonar_image = make_sidescan_sonar_image(fh, p, bitdepth=bitdepth, resize_half_width=resize_half_width, weighted=weighted)
-
-    # Write sonar image data to files, no georeferencing at this stage
-    sonar_image.save(tif_output)
-    print("TIF without georeference saved:", tif_output)
-    sonar_image.save(jpeg_output)
-    print("JPEG without georeference saved:", jpeg_output)
+    sonar_image = make_sidescan_sonar_image(fh, p, bitdepth=bitdepth, resize_half_width=resize_half_width, weighted=weighted, ground_range_correction=ground_range_correction, is_starboard=is_starboard)
 
     sonar_ch = p[pyxtf.XTFHeaderType.sonar]
 
@@ -116,42 +167,48 @@ if pyxtf.XTFHeaderType.sonar in p:
     last_ping = sonar_ch[-1]
     lp_s_lat, lp_s_lon, lp_o_lat, lp_o_lon = calculate_outermost_latlon_from_ping(fh, last_ping, is_starboard)
 
-    points = [(fp_s_lon, fp_s_lat), (fp_o_lon, fp_o_lat), (lp_s_lon, lp_s_lat), (lp_o_lon, lp_o_lat)]
-    print("Outermost points:", points)
-
-    try:
-        src = rasterio.open(tif_output) # NotGeoreferencedWarning can be ignored
-    except Exception as e:
-        print("Unable to load source tif for conversion to geotiff")
-        exit(-1)
-    
-    data = src.read(1)
-    height, width = src.height, src.width
-
-    # Copy the source metadata profile for use in the output
-    profile = src.profile.copy()
-    src.close()
-
-    sensor_pos_first_ping = (fp_s_lon, fp_s_lat)
-    sensor_pos_last_ping = (lp_s_lon, lp_s_lat)
-    outer_pos_first_ping = (fp_o_lon, fp_o_lat)
-    outer_pos_last_ping = (lp_o_lon, lp_o_lat)
-
-    # Calculate and compute an Affine transform
-    gcps = utils.create_gcps(sensor_pos_first_ping, sensor_pos_last_ping, outer_pos_first_ping, outer_pos_last_ping, is_starboard, height, width)
-    transform = rasterio.transform.from_gcps(gcps)
-    
-    # Write worldfiles, sidecar files for the jpeg to position and transform the jpeg in the map
-    target_crs = rasterio.CRS.from_epsg(4326)
-    srs_wkt = target_crs.to_wkt()
-    utils.write_pam_aux_xml(aux_xml_output, srs_wkt, transform)
-    utils.write_jgw(jgw_output, transform)
-
-    profile.update({
-        'crs': target_crs, # EPSG:4326 is assumed
-        'transform': transform
-    })
-
-    with rasterio.open(geotiff_output, "w", **profile) as dst:
-        dst.write(data, 1)
-    print("Geotiff output saved:", geotiff_output)
\ No newline at end of file
+# Write sonar image data to files, no georeferencing at this stage
+sonar_image.save(tif_output)
+print("TIF without georeference saved:", tif_output)
+sonar_image.save(jpeg_output)
+print("JPEG without georeference saved:", jpeg_output)
+
+points = [(fp_s_lon, fp_s_lat), (fp_o_lon, fp_o_lat), (lp_s_lon, lp_s_lat), (lp_o_lon, lp_o_lat)]
+print("Outermost points:", points)
+
+try:
+    src = rasterio.open(tif_output) # NotGeoreferencedWarning can be ignored
+except Exception as e:
+    print("Unable to load source tif for conversion to geotiff")
+    exit(-1)
+
+data = src.read(1)
+height, width = src.height, src.width
+
+# Copy the source metadata profile for use in the output
+profile = src.profile.copy()
+src.close()
+
+sensor_pos_first_ping = (fp_s_lon, fp_s_lat)
+sensor_pos_last_ping = (lp_s_lon, lp_s_lat)
+outer_pos_first_ping = (fp_o_lon, fp_o_lat)
+outer_pos_last_ping = (lp_o_lon, lp_o_lat)
+
+# Calculate and compute an Affine transform
+gcps = utils.create_gcps(sensor_pos_first_ping, sensor_pos_last_ping, outer_pos_first_ping, outer_pos_last_ping, is_starboard, height, width)
+transform = rasterio.transform.from_gcps(gcps)
+
+# Write worldfiles, sidecar files for the jpeg to position and transform the jpeg in the map
+target_crs = rasterio.CRS.from_epsg(4326)
+srs_wkt = target_crs.to_wkt()
+utils.write_pam_aux_xml(aux_xml_output, srs_wkt, transform)
+utils.write_jgw(jgw_output, transform)
+
+profile.update({
+    'crs': target_crs, # EPSG:4326 is assumed
+    'transform': transform
+})
+
+with rasterio.open(geotiff_output, "w", **profile) as dst:
+    dst.write(data, 1)
+print("Geotiff output saved:", geotiff_output)
\ No newline at end of file
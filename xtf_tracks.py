@@ -0,0 +1,212 @@
+"""
+Exports the navigation track and swath footprint of every XTF file in a folder as simplified vector geometry.
+Positions are read from ping headers only (see xtf_headers.py), the outer swath edge is computed per ping from
+SensorHeading and GroundRange, and lines are simplified with Douglas-Peucker before writing GeoJSON or GeoPackage.
+Each file is cached in the output folder, re-running on a growing folder only processes new or changed files.
+"""
+
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import utils # Local utility-file
+import geodesy # Local vectorized geodesic helpers
+import xtf_headers # Local metadata-only XTF reader
+
+CACHE_VERSION = 1
+
+def douglas_peucker(points, tolerance):
+    """
+    Simplifies a polyline with the Douglas-Peucker algorithm.
+
+    Parameters:
+      points (ndarray): Nx2 array of planar coordinates.
+      tolerance (float): Maximum distance from the simplified line, same unit as points.
+
+    Returns:
+      ndarray: Indices of the points to keep, in order.
+    """
+    n_points = len(points)
+    if n_points < 3:
+        return np.arange(n_points)
+
+    keep = np.zeros(n_points, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n_points - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        segment = points[end] - points[start]
+        relative = points[start + 1:end] - points[start]
+        segment_length = np.hypot(segment[0], segment[1])
+        if segment_length == 0:
+            distances = np.hypot(relative[:, 0], relative[:, 1])
+        else:
+            distances = np.abs(segment[0] * relative[:, 1] - segment[1] * relative[:, 0]) / segment_length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+def simplify_latlon(lat, lon, tolerance_m):
+    # Douglas-Peucker in a local equirectangular projection, so the tolerance is in meters
+    lat0 = np.mean(lat)
+    x = geodesy.degrees_to_meters(lon - np.mean(lon), lat0, for_longitude=True)
+    y = geodesy.degrees_to_meters(lat - lat0, lat0, for_longitude=False)
+    return douglas_peucker(np.column_stack((x, y)), tolerance_m)
+
+def extract_file_features(file_path, tolerance_m):
+    """
+    Reads ping headers of one XTF file and builds its track and footprint features.
+
+    Returns:
+      dict: Cache entry with file size, modification time and a list of GeoJSON features.
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    entry = {"version": CACHE_VERSION, "file": file_path.name, "size": stat.st_size, "mtime": stat.st_mtime, "tolerance_m": tolerance_m, "features": []}
+
+    fh, ping_headers, ping_chan_headers = xtf_headers.read_ping_headers(file_path)
+
+    if len(ping_headers) < 2:
+        print(f"Skipping {file_path.name}, fewer than two sonar pings")
+        return entry
+
+    if fh['NavUnits'] != 3:
+        print(f"Skipping {file_path.name}, NavUnits != 3, coordinates are in meters. Not implemented yet.")
+        return entry
+
+    is_starboard = xtf_headers.is_starboard_channel(fh)
+    if is_starboard is None:
+        print(f"Skipping {file_path.name}, unable to detect port or starboard in channel.")
+        return entry
+
+    sensor_lat = ping_headers['SensorYcoordinate']
+    sensor_lon = ping_headers['SensorXcoordinate']
+    acoustic_bearing_radians = utils.calculate_acoustic_bearing_radians(ping_headers['SensorHeading'], is_starboard)
+    outer_lat, outer_lon = utils.calculate_outermost_latlon(sensor_lat, sensor_lon, acoustic_bearing_radians, ping_chan_headers['GroundRange'])
+
+    track_keep = simplify_latlon(sensor_lat, sensor_lon, tolerance_m)
+    outer_keep = simplify_latlon(outer_lat, outer_lon, tolerance_m)
+
+    track = np.column_stack((sensor_lon[track_keep], sensor_lat[track_keep]))
+    outer = np.column_stack((outer_lon[outer_keep], outer_lat[outer_keep]))[::-1]
+    ring = np.concatenate((track, outer, track[:1]))
+
+    times = xtf_headers.ping_times(ping_headers)
+    properties = {
+        "file": file_path.name,
+        "side": "starboard" if is_starboard else "port",
+        "ping_count": int(len(ping_headers)),
+        "first_ping": int(ping_headers['PingNumber'][0]),
+        "last_ping": int(ping_headers['PingNumber'][-1]),
+        "start_time": str(times[0]),
+        "end_time": str(times[-1]),
+        "ground_range_m": float(np.mean(ping_chan_headers['GroundRange'])),
+    }
+
+    entry["features"] = [
+        {"type": "Feature", "geometry": {"type": "LineString", "coordinates": track.tolist()}, "properties": {**properties, "kind": "track"}},
+        {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring.tolist()]}, "properties": {**properties, "kind": "footprint"}},
+    ]
+    print(f"{file_path.name}: {len(ping_headers)} pings, track {len(track)} points, swath edge {len(outer)} points after simplification")
+    return entry
+
+def load_cache(cache_path, file_path, tolerance_m):
+    # Returns the cached entry if it is still valid for the file, otherwise None
+    if not cache_path.is_file():
+        return None
+    try:
+        entry = json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        return None
+    stat = file_path.stat()
+    if entry.get("version") != CACHE_VERSION or entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime or entry.get("tolerance_m") != tolerance_m:
+        return None
+    return entry
+
+def write_geojson(output_path, features):
+    collection = {"type": "FeatureCollection", "features": features}
+    with open(output_path, 'wt') as f:
+        json.dump(collection, f)
+
+def write_geopackage(output_path, features):
+    # fiona is only needed for GeoPackage output
+    import fiona
+
+    properties_schema = {"file": "str", "side": "str", "ping_count": "int", "first_ping": "int", "last_ping": "int",
+                         "start_time": "str", "end_time": "str", "ground_range_m": "float", "kind": "str"}
+
+    for layer, geometry_type, kind in [("tracks", "LineString", "track"), ("footprints", "Polygon", "footprint")]:
+        layer_features = [feature for feature in features if feature["properties"]["kind"] == kind]
+        schema = {"geometry": geometry_type, "properties": properties_schema}
+        with fiona.open(output_path, 'w', driver='GPKG', layer=layer, crs='EPSG:4326', schema=schema) as dst:
+            dst.writerecords(layer_features)
+
+def export_tracks(input_folder, output_path, tolerance_m=1.0, jobs=None):
+    cache_folder = output_path.parent / f".{output_path.stem}_cache"
+    cache_folder.mkdir(parents=True, exist_ok=True)
+
+    file_paths = sorted(file_path for file_path in input_folder.iterdir() if file_path.is_file() and file_path.suffix.lower() == '.xtf')
+
+    entries = {}
+    pending = []
+    for file_path in file_paths:
+        entry = load_cache(cache_folder / f"{file_path.stem}.json", file_path, tolerance_m)
+        if entry is None:
+            pending.append(file_path)
+        else:
+            entries[file_path] = entry
+
+    print(f"{len(file_paths)} XTF files, {len(entries)} cached, {len(pending)} to process")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {file_path: executor.submit(extract_file_features, file_path, tolerance_m) for file_path in pending}
+            for file_path, future in futures.items():
+                try:
+                    entry = future.result()
+                except Exception as e: # A file still being written during a dive is truncated, not cached so it is read again
+                    print(f"Skipping {file_path.name}, unable to read: {e!r}")
+                    continue
+                (cache_folder / f"{file_path.stem}.json").write_text(json.dumps(entry))
+                entries[file_path] = entry
+
+    features = [feature for file_path in file_paths if file_path in entries for feature in entries[file_path]["features"]]
+
+    if output_path.suffix.lower() == '.gpkg':
+        write_geopackage(output_path, features)
+    else:
+        write_geojson(output_path, features)
+    print(f"Saved {len(features)} features to {output_path}")
+
+def main(args):
+    input_folder = Path(args.input)
+    output_path = Path(args.output)
+
+    if not input_folder.is_dir():
+        print(f"The provided path {input_folder} is not a directory.")
+        return
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    export_tracks(input_folder, output_path, tolerance_m=args.tolerance, jobs=args.jobs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export track and swath footprint of all .xtf files in a folder to GeoJSON or GeoPackage.')
+    parser.add_argument('-i', '--input', default="xtfs", type=str, help='Input folder.')
+    parser.add_argument('-o', '--output', default="output/tracks.geojson", type=str, help='Output file, .geojson or .gpkg (requires fiona).')
+    parser.add_argument('-t', '--tolerance', default=1.0, type=float, help='Douglas-Peucker simplification tolerance in meters. (default 1.0)')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help='Worker processes. (default CPU count)')
+    args = parser.parse_args()
+
+    main(args)
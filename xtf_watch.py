@@ -0,0 +1,195 @@
+"""
+Watches a folder for XTF files arriving during a dive and makes TIFF (and optionally GeoTIFF) quick-looks as each file completes.
+A file is considered finished when its size and modification time have been unchanged for a number of polls.
+Finished files are queued to a pool of worker processes, the queue is bounded so the scanner waits when the workers fall behind.
+Queue depth and latency (from last write to the XTF until its quick-look is saved) are written to a JSON status file.
+Files that already have a quick-look newer than the XTF are not processed again.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import rasterio
+
+import utils # Local utility-file
+import xtf_headers # Local metadata-only XTF reader
+
+def georeference_quicklook(xtf_path: Path, tiff_path: Path, geotiff_path: Path):
+    # Same georeferencing as xtf_to_geotiff_and_geojpeg.py, positions from the ping headers only
+    fh, ping_headers, ping_chan_headers = xtf_headers.read_ping_headers(xtf_path)
+    is_starboard = xtf_headers.is_starboard_channel(fh)
+    if fh['NavUnits'] != 3 or is_starboard is None or len(ping_headers) < 2:
+        print(f"Unable to georeference {xtf_path.name}, skipping GeoTIFF")
+        return
+
+    sensor_lat = ping_headers['SensorYcoordinate'][[0, -1]]
+    sensor_lon = ping_headers['SensorXcoordinate'][[0, -1]]
+    acoustic_bearing_radians = utils.calculate_acoustic_bearing_radians(ping_headers['SensorHeading'][[0, -1]], is_starboard)
+    outer_lat, outer_lon = utils.calculate_outermost_latlon(sensor_lat, sensor_lon, acoustic_bearing_radians, ping_chan_headers['GroundRange'][[0, -1]])
+
+    with rasterio.open(tiff_path) as src: # NotGeoreferencedWarning can be ignored
+        data = src.read(1)
+        profile = src.profile.copy()
+
+    gcps = utils.create_gcps((sensor_lon[0], sensor_lat[0]), (sensor_lon[1], sensor_lat[1]), (outer_lon[0], outer_lat[0]), (outer_lon[1], outer_lat[1]), is_starboard, data.shape[0], data.shape[1])
+    profile.update({
+        'crs': rasterio.CRS.from_epsg(4326), # EPSG:4326 is assumed
+        'transform': rasterio.transform.from_gcps(gcps)
+    })
+    with rasterio.open(geotiff_path, "w", **profile) as dst:
+        dst.write(data, 1)
+
+def make_quicklook(xtf_path: Path, output_folder_path: Path, geotiff: bool):
+    # Runs in a worker process
+    import xtf2tiff
+
+    # The GCPs pin column 0 to nadir and the last column to GroundRange, so a georeferenced quick-look keeps all columns
+    column_threshold = -1 if geotiff else 7
+    xtf2tiff.convert_xtf_tiff(file_path=xtf_path, output_folder_path=output_folder_path, output_bitdepth=8, resize_half_width=True, histogram_equalization=False, column_threshold=column_threshold)
+    tiff_path = output_folder_path / f"{xtf_path.stem}.tiff"
+    if geotiff:
+        georeference_quicklook(xtf_path, tiff_path, output_folder_path / f"{xtf_path.stem}_geotiff.tif")
+    return tiff_path
+
+class FolderWatcher:
+    def __init__(self, input_folder: Path, output_folder: Path, status_path: Path, poll_interval=1.0, stable_polls=2, queue_size=4, workers=2, geotiff=False):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.status_path = status_path
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self.workers = workers
+        self.geotiff = geotiff
+
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.seen = {} # path: (size, mtime, polls unchanged)
+        self.done = {} # path: (size, mtime) of the processed version
+        self.queued = set()
+        self.in_progress = set()
+        self.failed = {}
+        self.latencies = []
+
+    def is_up_to_date(self, xtf_path, mtime):
+        # A quick-look newer than the XTF was made by an earlier run
+        tiff_path = self.output_folder / f"{xtf_path.stem}.tiff"
+        return tiff_path.is_file() and tiff_path.stat().st_mtime >= mtime
+
+    async def scan(self):
+        while True:
+            for xtf_path in sorted(self.input_folder.glob('*.xtf')):
+                try:
+                    stat = xtf_path.stat()
+                except FileNotFoundError:
+                    continue
+                state = (stat.st_size, stat.st_mtime)
+
+                if self.done.get(xtf_path) == state or xtf_path in self.queued or xtf_path in self.in_progress:
+                    continue
+
+                size, mtime, unchanged = self.seen.get(xtf_path, (None, None, 0))
+                unchanged = unchanged + 1 if (size, mtime) == state else 0
+                self.seen[xtf_path] = (*state, unchanged)
+
+                if unchanged < self.stable_polls:
+                    continue
+
+                if xtf_path not in self.done and self.is_up_to_date(xtf_path, stat.st_mtime):
+                    self.done[xtf_path] = state
+                    continue
+
+                logging.info(f"{xtf_path.name} is complete, queueing")
+                self.queued.add(xtf_path)
+                self.write_status()
+                await self.queue.put((xtf_path, state)) # Waits here when the workers are behind
+
+            self.write_status()
+            await asyncio.sleep(self.poll_interval)
+
+    async def worker(self, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            xtf_path, state = await self.queue.get()
+            self.queued.discard(xtf_path)
+            self.in_progress.add(xtf_path)
+            self.write_status()
+
+            print(f"Processing file: {xtf_path}")
+            try:
+                tiff_path = await loop.run_in_executor(executor, make_quicklook, xtf_path, self.output_folder, self.geotiff)
+                latency = time.time() - state[1]
+                self.latencies.append(latency)
+                self.failed.pop(str(xtf_path), None)
+                print(f"Quick-look {tiff_path} ready, {latency:.1f} s after last write to {xtf_path.name}")
+            except (Exception, SystemExit) as e: # xtf2tiff exits on unsupported files
+                self.failed[str(xtf_path)] = repr(e)
+                print(f"Failed processing {xtf_path}: {e!r}")
+
+            self.done[xtf_path] = state
+            self.in_progress.discard(xtf_path)
+            self.queue.task_done()
+            self.write_status()
+
+    def write_status(self):
+        recent = self.latencies[-20:]
+        status = {
+            "time": time.time(),
+            "queue_depth": self.queue.qsize(),
+            "in_progress": sorted(str(path) for path in self.in_progress),
+            "waiting_for_stable_size": sorted(str(path) for path, (_, _, unchanged) in self.seen.items() if path not in self.done and path not in self.queued and path not in self.in_progress and unchanged < self.stable_polls),
+            "processed": len(self.latencies),
+            "failed": self.failed,
+            "last_latency_s": self.latencies[-1] if self.latencies else None,
+            "mean_latency_s": sum(recent) / len(recent) if recent else None,
+        }
+        temporary_path = self.status_path.with_suffix('.tmp')
+        temporary_path.write_text(json.dumps(status, indent=2))
+        temporary_path.replace(self.status_path) # Readers never see a half written file
+
+    async def run(self):
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        print(f"Watching {self.input_folder} for .xtf, quick-looks in {self.output_folder}, status in {self.status_path}")
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            workers = [asyncio.create_task(self.worker(executor)) for _ in range(self.workers)]
+            await self.scan()
+            for worker in workers:
+                worker.cancel()
+
+def main(args):
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    input_folder = Path(args.input)
+    output_folder = Path(args.output)
+
+    if not input_folder.is_dir():
+        print(f"The provided path {input_folder} is not a directory.")
+        return
+
+    status_path = Path(args.status) if args.status else output_folder / "watch_status.json"
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    watcher = FolderWatcher(input_folder, output_folder, status_path, poll_interval=args.poll_interval, stable_polls=args.stable_polls, queue_size=args.queue_size, workers=args.workers, geotiff=args.geotiff)
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Watch a folder and make quick-look .tiff of each .xtf when it is complete.')
+    parser.add_argument('-i', '--input', default="xtfs", type=str, help='Input folder.')
+    parser.add_argument('-o', '--output', default="tiffs", type=str, help='Output folder.')
+    parser.add_argument('-g', '--geotiff', default=False, action='store_true', help='Also write a georeferenced quick-look, <name>_geotiff.tif. Empty columns are then kept in the quick-looks. (default False)')
+    parser.add_argument('-w', '--workers', default=2, type=int, help='Worker processes. (default 2)')
+    parser.add_argument('-q', '--queue_size', default=4, type=int, help='Finished files waiting for a worker before scanning pauses. (default 4)')
+    parser.add_argument('-p', '--poll_interval', default=1.0, type=float, help='Seconds between folder scans. (default 1.0)')
+    parser.add_argument('-sp', '--stable_polls', default=2, type=int, help='Scans with unchanged size before a file is complete. (default 2)')
+    parser.add_argument('-st', '--status', default=None, type=str, help='Status file. (default <output>/watch_status.json)')
+    parser.add_argument('-v', '--verbose', default=False, action='store_true', help='Verbose mode.')
+    args = parser.parse_args()
+
+    main(args)
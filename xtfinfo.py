@@ -1,44 +1,143 @@
+import json
+import argparse
 import numpy as np
-from pyxtf import xtf_read, concatenate_channel, XTFHeaderType, XTFChannelType
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import geodesy # Local vectorized geodesic helpers
+import xtf_headers # Local metadata-only XTF reader
 
 xtf_path = 'xtfs\sasi-P-upper-20240314-110550-wrk_l1.xtf'
 
-def haversine(lat1, lon1, lat2, lon2):
+def value_statistics(values):
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return None
+    return {"min": float(values.min()), "max": float(values.max()), "mean": float(values.mean())}
+
+def summarize_xtf(file_path):
     """
-    Calculate the great circle distance between two points
-    on the earth (specified in decimal degrees)
+    Summarizes an XTF file from headers only, no ping samples are decoded.
+
+    Returns:
+      dict: Ping count, time span, track length, range/resolution statistics and channel layout.
     """
-    # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-    c = 2 * np.arcsin(np.sqrt(a))
-    r = 6371  # Radius of earth in kilometers. Use 3956 for miles
-    return c * r
-
-def main():
-    (fh, p) = xtf_read(xtf_path)
+    file_path = Path(file_path)
+    fh, ping_headers, ping_chan_headers = xtf_headers.read_ping_headers(file_path)
+
+    n_channels = xtf_headers.number_of_channels(fh)
+    chan_info = xtf_headers.read_chan_info(file_path, fh)
+    channels = [{
+        "index": i,
+        "name": chan_info[i]['ChannelName'].decode(errors='replace').strip('\x00 '),
+        "type_of_channel": int(chan_info[i]['TypeOfChannel']),
+        "bytes_per_sample": int(chan_info[i]['BytesPerSample']),
+        "sample_format": int(chan_info[i]['SampleFormat']),
+        "frequency": float(chan_info[i]['Frequency']),
+    } for i in range(len(chan_info))]
+
+    summary = {
+        "file": file_path.name,
+        "sonar_name": fh['SonarName'].decode(errors='replace').strip('\x00 '),
+        "nav_units": int(fh['NavUnits']),
+        "channel_count": n_channels,
+        "channels": channels,
+        "channels_truncated": len(channels) < n_channels, # File ends inside the ChanInfo blocks
+        "ping_count": int(len(ping_headers)),
+    }
+
+    if len(ping_headers) == 0:
+        return summary
+
+    times = xtf_headers.ping_times(ping_headers)
+    lat = ping_headers['SensorYcoordinate']
+    lon = ping_headers['SensorXcoordinate']
+
+    if fh['NavUnits'] == 3: # Lat/Long
+        track_length = geodesy.haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum()
+    else: # Coordinates are in meters
+        track_length = np.hypot(np.diff(lat), np.diff(lon)).sum()
+
+    slant_range = ping_chan_headers['SlantRange']
+    num_samples = ping_chan_headers['NumSamples']
+    valid = num_samples > 0
+
+    summary.update({
+        "first_ping": int(ping_headers['PingNumber'][0]),
+        "last_ping": int(ping_headers['PingNumber'][-1]),
+        "start_time": str(times[0]),
+        "end_time": str(times[-1]),
+        "duration_s": float((times[-1] - times[0]) / np.timedelta64(1, 's')),
+        "track_length_m": float(track_length),
+        "start_position": [float(lat[0]), float(lon[0])],
+        "end_position": [float(lat[-1]), float(lon[-1])],
+        "samples_per_ping": value_statistics(num_samples),
+        "slant_range_m": value_statistics(slant_range),
+        "ground_range_m": value_statistics(ping_chan_headers['GroundRange']),
+        "altitude_m": value_statistics(ping_headers['SensorPrimaryAltitude']),
+        "cm_per_pixel": value_statistics(slant_range[valid] / num_samples[valid] * 100),
+    })
+    return summary
+
+def summarize_xtf_or_error(file_path):
+    # One unreadable file (empty, truncated) gives an error entry instead of stopping a folder summary
+    try:
+        return summarize_xtf(file_path)
+    except (ValueError, OSError) as e:
+        return {"file": Path(file_path).name, "error": str(e)}
+
+def print_pings(file_path):
+    # Full read through pyxtf, decodes every ping
+    from pyxtf import xtf_read, XTFHeaderType
+
+    (fh, p) = xtf_read(file_path)
     print(fh)
     if XTFHeaderType.sonar in p:
-        
+
         first_ping = p[XTFHeaderType.sonar][0]
         last_ping = p[XTFHeaderType.sonar][-1]
 
         print(first_ping.PingNumber, first_ping.SensorYcoordinate, first_ping.SensorXcoordinate)
         print(last_ping.PingNumber, last_ping.SensorYcoordinate, last_ping.SensorXcoordinate)
 
-        distance = haversine(first_ping.SensorYcoordinate, first_ping.SensorXcoordinate, last_ping.SensorYcoordinate, last_ping.SensorXcoordinate)
+        distance = geodesy.haversine(first_ping.SensorYcoordinate, first_ping.SensorXcoordinate, last_ping.SensorYcoordinate, last_ping.SensorXcoordinate)
 
-        print(f"The distance between the points is {distance:.2f} km.")
-        print(f"The distance between the points is {distance*1000:.2f} m.")
+        print(f"The distance between the points is {distance/1000:.2f} km.")
+        print(f"The distance between the points is {distance:.2f} m.")
 
         for ping in p[XTFHeaderType.sonar]:
             data_elements_in_ping = len(ping.data[0])
             print(f"{ping.PingNumber}, {data_elements_in_ping} {ping.SensorYcoordinate}, {ping.SensorXcoordinate}, {ping.ping_chan_headers[0].SlantRange}, {ping.ping_chan_headers[0].GroundRange}, {ping.ping_chan_headers[0].SlantRange/data_elements_in_ping*100} cm/pixel")
 
+def main(args):
+    input_path = Path(args.input)
+
+    if not args.fast:
+        print_pings(input_path)
+        return
+
+    if input_path.is_dir():
+        file_paths = sorted(file_path for file_path in input_path.iterdir() if file_path.is_file() and file_path.suffix.lower() == '.xtf')
+    elif input_path.is_file():
+        file_paths = [input_path]
+    else:
+        print(f"The provided path {input_path} does not exist.")
+        return
+
+    if len(file_paths) > 1 and args.jobs != 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            summaries = list(executor.map(summarize_xtf_or_error, file_paths))
+    else:
+        summaries = [summarize_xtf_or_error(file_path) for file_path in file_paths]
+
+    output = summaries[0] if input_path.is_file() else summaries
+    print(json.dumps(output, indent=2))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Print information about an XTF file, or summarize a folder of XTF files.')
+    parser.add_argument('input', default=xtf_path, nargs='?', type=str, help='XTF file, or folder of XTF files in fast mode.')
+    parser.add_argument('-f', '--fast', default=False, action='store_true', help='Metadata-only JSON summary, reads headers without decoding ping samples.')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help='Worker processes for folders in fast mode. (default CPU count)')
+    args = parser.parse_args()
+
+    main(args)